@@ -5,6 +5,11 @@ This package provides tools for fetching and analyzing Synthetic Aperture Radar
 from Copernicus and COSMO-SkyMed satellites.
 """
 
+from dotenv import load_dotenv
+
+# Load .env once for the whole package
+load_dotenv()
+
 from sentinel_sar.analyzer import SARAnalyzer
 
 __version__ = "0.1.0"
\ No newline at end of file
@@ -2,36 +2,98 @@
 Main SARAnalyzer class that coordinates all SAR data operations.
 """
 
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, Iterable, Iterator, List, Any, Tuple
+import os
+import asyncio
+import functools
+import importlib.util
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from pathlib import Path
 
+import numpy as np
+import requests
+
 from sentinel_sar.auth import authenticate
+from sentinel_sar.session import create_session, POOL_MAXSIZE
 from sentinel_sar.processing import (
     create_aoi_from_coordinates,
     search_sar_data,
+    _search_products,
+    _select_products,
     download_products,
+    iter_download_products,
+    download_products_async,
+    download_annotations,
     process_sentinel1_data,
+    convert_to_cog,
     preprocess_sar_data,
-    detect_subsurface_features
+    detect_subsurface_features,
+    _download_workers
 )
-from sentinel_sar.visualization import visualize_results
+from sentinel_sar.visualization import visualize_results, _for_display
 
 logger = logging.getLogger(__name__)
 
+# GDAL settings shared by all raster reads of one analysis run
+_RIO_ENV_OPTIONS = {
+    # Decode compressed blocks on all cores
+    'GDAL_NUM_THREADS': 'ALL_CPUS',
+    'GDAL_CACHEMAX': 512,
+    # Local products carry no sidecar files worth listing the directory for
+    'GDAL_DISABLE_READDIR_ON_OPEN': 'EMPTY_DIR',
+    'VSI_CACHE': 'TRUE',
+    'VSI_CACHE_SIZE': 268435456
+}
+
+def _has_rasterio() -> bool:
+    """Check that rasterio is installed without importing it (and GDAL) yet."""
+    return importlib.util.find_spec('rasterio') is not None
+
+def _results_filename(file_path: str, area: Optional[int] = None) -> str:
+    """Name of the results image for a product file, and an area index if given."""
+    name = Path(file_path).name.split('.', 1)[0]
+    suffix = f"_area{area}" if area is not None else ''
+    return f"sar_analysis_results_{name}{suffix}.png"
+
+def _analyze_file_worker(download_path: str, file_path: str,
+                         bounds: Tuple[float, float, float, float]) -> Optional[Tuple[Any, Any, Any]]:
+    """Process-pool entry point running the processing chain for one file.
+    
+    The arrays are reduced to display resolution before they are pickled
+    back, so full-resolution bands and memmapped caches never cross the pipe.
+    """
+    analyzer = SARAnalyzer(download_path=download_path)
+    result = analyzer._analyze_file_in_env(file_path, bounds)
+    if result is None:
+        return None
+    return tuple(_for_display(data) for data in result)
+
 class SARAnalyzer:
     """A class for fetching and analyzing SAR data from Copernicus Sentinel-1."""
     
+    __slots__ = ('username', 'password', 'client_id', 'client_secret', 'api',
+                 '_session', 'download_workers', 'products', 'download_path')
+    
     def __init__(self, username: Optional[str] = None, password: Optional[str] = None, 
-                 client_id: Optional[str] = None, client_secret: Optional[str] = None):
+                 client_id: Optional[str] = None, client_secret: Optional[str] = None,
+                 download_path: Optional[str] = None, session: Optional[requests.Session] = None,
+                 download_workers: Optional[int] = None):
         self.username = username
         self.password = password
         self.client_id = client_id
         self.client_secret = client_secret
         self.api = None
+        # More workers than the shared pool holds get a session sized for them
+        if session is None and download_workers and download_workers > POOL_MAXSIZE:
+            session = create_session(workers=download_workers)
+        self._session = session
+        # Parallel downloads; None uses the CDSE quota (MAX_PARALLEL_DOWNLOADS)
+        self.download_workers = download_workers
         self.products = None
-        self.download_path = Path.cwd() / 'data'
-        self.download_path.mkdir(exist_ok=True)
+        self.download_path = Path(download_path) if download_path else Path.cwd() / 'data'
+        self.download_path.mkdir(parents=True, exist_ok=True)
     
     def authenticate(self, api_url: str = 'https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token') -> bool:
         """Authenticate with the Copernicus Data Space Ecosystem or Open Access Hub."""
@@ -52,9 +114,21 @@ class SARAnalyzer:
     
 
     
-    def download_products(self, limit: int = 1) -> List[str]:
+    def download_products(self, limit: int = 1, products: Optional[List[Dict]] = None) -> List[str]:
         """Download the found products."""
-        return download_products(self, limit)
+        return download_products(self, limit, products)
+    
+    def iter_download_products(self, limit: int = 1, products: Optional[List[Dict]] = None) -> Iterator[str]:
+        """Download the found products, yielding each file as soon as it is saved."""
+        return iter_download_products(self, limit, products)
+    
+    async def download_products_async(self, limit: int = 1, products: Optional[List[Dict]] = None) -> List[str]:
+        """Download the found products without blocking the event loop."""
+        return await download_products_async(self, limit, products)
+    
+    def download_annotations(self, limit: int = 1) -> List[str]:
+        """Download only the annotation and preview files of the found products."""
+        return download_annotations(self, limit)
     
 
     
@@ -62,21 +136,104 @@ class SARAnalyzer:
         """Process Sentinel-1 specific data format."""
         return process_sentinel1_data(self, file_path)
     
+    def convert_to_cog(self, file_path: str) -> Optional[str]:
+        """Convert a raster to a Cloud-Optimized GeoTIFF, reusing a previous conversion."""
+        return convert_to_cog(self, file_path)
+    
 
     
-    def preprocess_sar_data(self, file_path: str) -> Optional[Any]:
-        """Preprocess the SAR data for analysis."""
-        return preprocess_sar_data(self, file_path)
+    def preprocess_sar_data(self, file_path: str,
+                            bounds: Optional[Tuple[float, float, float, float]] = None,
+                            return_original: bool = False,
+                            dtype: Optional[type] = None) -> Optional[Any]:
+        """Preprocess the SAR data for analysis, optionally clipped to the AOI bounds."""
+        return preprocess_sar_data(self, file_path, bounds, return_original, dtype)
 
     @staticmethod
-    def detect_subsurface_features(sar_data: Any, threshold: float = 0.7) -> Optional[Any]:
+    def detect_subsurface_features(sar_data: Any, threshold: float = 0.7,
+                                   percentile: Optional[float] = None) -> Optional[Any]:
         """Detect potential subsurface features in the SAR data."""
-        return detect_subsurface_features(sar_data, threshold)
+        return detect_subsurface_features(sar_data, threshold, percentile)
     
     def visualize_results(self, original_data: Any, processed_data: Any, 
-                          features: Any, title: str = "SAR Analysis Results") -> None:
+                          features: Any, title: str = "SAR Analysis Results",
+                          headless: bool = False, filename: str = 'sar_analysis_results.png') -> None:
         """Visualize the original data, processed data, and detected features."""
-        visualize_results(self, original_data, processed_data, features, title)
+        visualize_results(self, original_data, processed_data, features, title, headless, filename)
+    
+    def _analyze_file(self, file_path: str,
+                      bounds: Tuple[float, float, float, float]) -> Optional[Tuple[Any, Any, Any]]:
+        """Run the processing chain on one file.
+        
+        Returns (original_data, processed_data, features), or None if a step failed.
+        """
+        logger.info(f"Processing {file_path}...")
+        
+        processed_file = self.process_sentinel1_data(file_path)
+        if not processed_file:
+            return None
+        
+        # Tiled COG reads touch only the blocks inside the AOI window
+        processed_file = self.convert_to_cog(processed_file) or processed_file
+        
+        # The original band comes back from the same read, so the file is opened
+        # only once; detection only needs 256 levels, so the band is uint8
+        preprocessed = self.preprocess_sar_data(processed_file, bounds, return_original=True,
+                                                dtype=np.uint8)
+        if preprocessed is None:
+            return None
+        processed_data, original_data = preprocessed
+        
+        features = self.detect_subsurface_features(processed_data)
+        if features is None:
+            return None
+        
+        return original_data, processed_data, features
+    
+    def _visualize_analysis(self, result: Optional[Tuple[Any, Any, Any]], file_path: str,
+                            area: Optional[int] = None) -> None:
+        """Visualize the output of `_analyze_file` if it succeeded.
+        
+        Each product (and area, for multi-area runs) gets its own image, so
+        results finishing together never overwrite each other.
+        """
+        if result is None:
+            return
+        try:
+            self.visualize_results(*result, filename=_results_filename(file_path, area))
+        except Exception as e:
+            logger.error(f"Error visualizing results: {e}")
+    
+    def _run_pipeline(self, downloaded_files: Iterable[str],
+                      bounds: Tuple[float, float, float, float], limit: int) -> bool:
+        """Process and visualize files as they arrive; False if none arrived."""
+        downloaded_any = False
+        
+        if limit == 1:
+            import rasterio
+            
+            # Keep one GDAL environment (and its block cache) for the whole loop
+            with rasterio.Env(**_RIO_ENV_OPTIONS):
+                for file_path in downloaded_files:
+                    downloaded_any = True
+                    self._visualize_analysis(self._analyze_file(file_path, bounds), file_path)
+        else:
+            # Files are independent, so process them on separate cores;
+            # workers only receive paths, and plotting stays in this process.
+            # Spawned workers never inherit the download threads or GDAL state.
+            # Half the cores, as each worker's filters are multi-threaded too.
+            max_workers = min(limit, max(1, (os.cpu_count() or 1) // 2))
+            with ProcessPoolExecutor(max_workers=max_workers,
+                                     mp_context=multiprocessing.get_context('spawn')) as executor:
+                futures = {
+                    executor.submit(_analyze_file_worker, str(self.download_path), file_path, bounds): file_path
+                    for file_path in downloaded_files
+                }
+                downloaded_any = bool(futures)
+                for future in as_completed(futures):
+                    self._visualize_analysis(future.result(), futures[future])
+        
+        return downloaded_any
     
     def analyze_area(
         self,
@@ -87,7 +244,8 @@ class SARAnalyzer:
         start_date: str,
         end_date: str,
         orbit_direction: str = 'ASCENDING',
-        sensor_mode: str = 'IW'
+        sensor_mode: str = 'IW',
+        limit: int = 1
     ) -> bool:
         """Complete workflow to analyze an area of interest."""
         try:
@@ -112,35 +270,130 @@ class SARAnalyzer:
                 logger.warning("No products found for the specified parameters.")
                 return False
             
-            downloaded_files = self.download_products(limit=1)
-            if not downloaded_files:
-                logger.error("Failed to download any products.")
+            if not _has_rasterio():
+                logger.error("rasterio is required to analyze the downloaded products")
                 return False
             
-            for file_path in downloaded_files:
-                logger.info(f"Processing {file_path}...")
-                
-                processed_file = self.process_sentinel1_data(file_path)
-                if processed_file:
-                    processed_data = self.preprocess_sar_data(processed_file)
-                    if processed_data is not None:
-                        features = self.detect_subsurface_features(processed_data)
-                        if features is not None:
-                            try:
-                                import rasterio
-                                with rasterio.open(processed_file) as src:
-                                    original_data = src.read(1)
-                                self.visualize_results(
-                                    original_data, 
-                                    processed_data, 
-                                    features
-                                )
-                            except Exception as e:
-                                logger.error(f"Error visualizing results: {e}")
-                                continue
+            bounds = (min_lon, min_lat, max_lon, max_lat)
+            
+            # Files are yielded as their downloads finish, so processing the
+            # first one overlaps with the remaining downloads
+            if not self._run_pipeline(self.iter_download_products(limit=limit), bounds, limit):
+                logger.error("Failed to download any products.")
+                return False
 
             return True
             
         except Exception as e:
             logger.error(f"Analysis failed: {e}")
-            return False
\ No newline at end of file
+            return False
+    
+    def _analyze_file_in_env(self, file_path: str,
+                             bounds: Tuple[float, float, float, float]) -> Optional[Tuple[Any, Any, Any]]:
+        """Run `_analyze_file` inside its own GDAL environment (for worker threads)."""
+        import rasterio
+        
+        with rasterio.Env(**_RIO_ENV_OPTIONS):
+            return self._analyze_file(file_path, bounds)
+    
+    async def _analyze_one_async(
+        self,
+        bounds: Tuple[float, float, float, float],
+        start_date: str,
+        end_date: str,
+        orbit_direction: str,
+        sensor_mode: str,
+        download_slots: asyncio.Semaphore,
+        scenes: Dict[str, Tuple['asyncio.Future', asyncio.Lock]],
+        analysis_executor: ThreadPoolExecutor,
+        area: int
+    ) -> bool:
+        """Search, download and process one area of interest without blocking the event loop.
+        
+        `scenes` is shared by all areas of one run: a scene covering several
+        areas is downloaded once, and processed for one area at a time.
+        """
+        loop = asyncio.get_running_loop()
+        
+        footprint = self.create_aoi_from_coordinates(*bounds)
+        # The search result stays local; analyzer.products is shared by all areas
+        products = await loop.run_in_executor(None, functools.partial(
+            _search_products,
+            self,
+            footprint,
+            start_date,
+            end_date,
+            orbit_direction=orbit_direction,
+            sensor_mode=sensor_mode
+        ))
+        if not products:
+            logger.warning(f"No products found for area {bounds}.")
+            return False
+        
+        product = _select_products(products, 1)[0]
+        scene_id = product.get('id') or product.get('properties', {}).get('title')
+        if scene_id not in scenes:
+            scenes[scene_id] = (loop.create_task(self._download_scene_async(product, download_slots)),
+                                asyncio.Lock())
+        download, processing = scenes[scene_id]
+        
+        # Areas sharing the scene wait for the same download instead of
+        # writing the same .part file
+        downloaded_files = await download
+        if not downloaded_files:
+            logger.error(f"Failed to download any products for area {bounds}.")
+            return False
+        
+        # Extraction and COG conversion write next to the product, so only
+        # one area processes it at a time; the others reuse those files
+        async with processing:
+            for file_path in downloaded_files:
+                result = await loop.run_in_executor(analysis_executor, self._analyze_file_in_env,
+                                                    file_path, bounds)
+                # Matplotlib must stay on the event loop thread
+                self._visualize_analysis(result, file_path, area)
+        
+        return True
+    
+    async def _download_scene_async(self, product: Dict, download_slots: asyncio.Semaphore) -> List[str]:
+        """Download one product, bounding concurrent downloads across all areas."""
+        async with download_slots:
+            return await self.download_products_async(1, [product])
+    
+    async def analyze_area_async(
+        self,
+        areas: List[Tuple[float, float, float, float]],
+        start_date: str,
+        end_date: str,
+        orbit_direction: str = 'ASCENDING',
+        sensor_mode: str = 'IW'
+    ) -> List[bool]:
+        """Analyze several areas of interest concurrently.
+        
+        Each area is a (min_lon, min_lat, max_lon, max_lat) tuple; the result
+        list holds the success flag of each area in the same order.
+        """
+        if not _has_rasterio():
+            logger.error("rasterio is required to analyze the downloaded products")
+            return [False] * len(areas)
+        
+        if not self.authenticate():
+            return [False] * len(areas)
+        
+        download_slots = asyncio.Semaphore(_download_workers(self))
+        scenes = {}
+        # Analyses run one at a time: the Numba kernels already use every core,
+        # and Numba's default workqueue threading layer aborts the process
+        # when parallel kernels are called from two threads at once
+        with ThreadPoolExecutor(max_workers=1) as analysis_executor:
+            results = await asyncio.gather(
+                *(self._analyze_one_async(bounds, start_date, end_date, orbit_direction,
+                                          sensor_mode, download_slots, scenes, analysis_executor, area)
+                  for area, bounds in enumerate(areas)),
+                return_exceptions=True
+            )
+        
+        for bounds, result in zip(areas, results):
+            if isinstance(result, Exception):
+                logger.error(f"Analysis failed for area {bounds}: {result}")
+        return [result is True for result in results]
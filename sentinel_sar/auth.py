@@ -1,21 +1,37 @@
-
-import os
 import logging
-import requests
-from dotenv import load_dotenv
 
+from sentinel_sar.cache import make_cache_key, cache_get, cache_set, cache_delete
+from sentinel_sar.session import get_session, HTTP_TIMEOUT
+from sentinel_sar.utils import json_loads
 
-load_dotenv()
 logger = logging.getLogger(__name__)
 
-def authenticate(analyzer, api_url: str = 'https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token') -> bool:
-    """Authenticate with the Copernicus Data Space Ecosystem."""
+# Seconds before expiry at which a cached token is no longer reused
+_TOKEN_EXPIRY_MARGIN = 30
+
+def authenticate(analyzer, api_url: str = 'https://identity.dataspace.copernicus.eu/auth/realms/CDSE/protocol/openid-connect/token',
+                 force: bool = False) -> bool:
+    """Authenticate with the Copernicus Data Space Ecosystem.
+    
+    With `force`, the cached token is evicted and a new one is requested,
+    e.g. after the API rejected the cached one.
+    """
     try:
         # Check if client credentials are provided
         if not analyzer.client_id or not analyzer.client_secret:
             logger.error("Client ID and Client Secret are required for authentication")
             return False
             
+        # Reuse a cached token if it is still valid
+        cache_key = make_cache_key(analyzer.client_id, api_url, secret=analyzer.client_secret)
+        if force:
+            cache_delete('tokens', cache_key)
+        cached_token = None if force else cache_get('tokens', cache_key)
+        if cached_token:
+            analyzer.api = cached_token
+            logger.info("Using cached access token")
+            return True
+        
         # Log authentication attempt
         logger.info(f"Authenticating with Copernicus Data Space Ecosystem")
         
@@ -27,11 +43,14 @@ def authenticate(analyzer, api_url: str = 'https://identity.dataspace.copernicus
         }
         
         # Make the authentication request
-        response = requests.post(api_url, data=payload)
+        response = get_session(analyzer).post(api_url, data=payload, timeout=HTTP_TIMEOUT)
         
         if response.status_code == 200:
-            token_data = response.json()
+            token_data = json_loads(response.content)
             analyzer.api = token_data.get('access_token')
+            expires_in = token_data.get('expires_in')
+            if analyzer.api and expires_in:
+                cache_set('tokens', cache_key, analyzer.api, float(expires_in) - _TOKEN_EXPIRY_MARGIN)
             logger.info("Authentication successful")
             return True
         else:
@@ -42,6 +61,3 @@ def authenticate(analyzer, api_url: str = 'https://identity.dataspace.copernicus
     except Exception as e:
         logger.error(f"Authentication error: {e}")
         return False
-
-
-
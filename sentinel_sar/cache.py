@@ -0,0 +1,103 @@
+"""
+On-disk cache helpers for tokens and other short-lived API results.
+"""
+
+import os
+import json
+import time
+import hmac
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = Path(os.getenv('SENTINEL_SAR_CACHE_DIR', Path.home() / '.cache' / 'sentinel_sar'))
+
+# Most recently used entries are also kept in memory, so repeated lookups
+# in one process skip reading and parsing the file
+MEMORY_CACHE_SIZE = 32
+_memory_cache: 'OrderedDict[Tuple[str, str], Tuple[Any, float]]' = OrderedDict()
+_memory_lock = threading.Lock()
+
+def _remember(namespace: str, key: str, value: Any, exp: float) -> None:
+    """Store an entry in the in-memory LRU, evicting the oldest one when full."""
+    with _memory_lock:
+        _memory_cache[(namespace, key)] = (value, exp)
+        _memory_cache.move_to_end((namespace, key))
+        while len(_memory_cache) > MEMORY_CACHE_SIZE:
+            _memory_cache.popitem(last=False)
+
+def make_cache_key(*parts: Any, secret: Optional[str] = None) -> str:
+    """Build a stable cache key from the given parts.
+    
+    With a secret the key is an HMAC, so it cannot be derived from the parts alone.
+    """
+    message = '|'.join(str(part) for part in parts).encode()
+    if secret is not None:
+        return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+    return hashlib.sha256(message).hexdigest()
+
+def _cache_path(namespace: str, key: str) -> Path:
+    return CACHE_DIR / namespace / f"{key}.json"
+
+def cache_get(namespace: str, key: str) -> Optional[Any]:
+    """Return a cached value, or None if it is missing or expired."""
+    with _memory_lock:
+        entry = _memory_cache.get((namespace, key))
+        if entry is not None:
+            if entry[1] > time.time():
+                _memory_cache.move_to_end((namespace, key))
+                return entry[0]
+            del _memory_cache[(namespace, key)]
+    
+    try:
+        with open(_cache_path(namespace, key), 'r') as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return None
+    
+    if entry.get('exp', 0) <= time.time():
+        return None
+    _remember(namespace, key, entry.get('value'), entry['exp'])
+    return entry.get('value')
+
+def cache_delete(namespace: str, key: str) -> None:
+    """Remove an entry from memory and disk, e.g. a token the server rejected."""
+    with _memory_lock:
+        _memory_cache.pop((namespace, key), None)
+    try:
+        _cache_path(namespace, key).unlink(missing_ok=True)
+    except OSError as e:
+        logger.warning(f"Could not delete cache entry: {e}")
+
+def cache_set(namespace: str, key: str, value: Any, expire: float) -> bool:
+    """Store a JSON-serializable value that expires after `expire` seconds.
+    
+    The entry is written to a private (0600) temporary file and moved into
+    place atomically, so readers never see a partial entry.
+    """
+    exp = time.time() + expire
+    _remember(namespace, key, value, exp)
+    
+    try:
+        path = _cache_path(namespace, key)
+        path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # mkstemp picks a unique 0600 name, so concurrent writers (threads or
+        # processes) and leftovers from a crashed run never collide
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{path.name}.", suffix='.tmp', dir=path.parent)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'value': value, 'exp': exp}, f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"Could not write cache entry: {e}")
+        return False
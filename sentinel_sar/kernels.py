@@ -0,0 +1,131 @@
+"""
+Numba kernels for the SAR processing functions.
+
+Importing this module imports Numba, so `utils.numba_kernels` loads it
+on first use; callers fall back to NumPy and SciPy without Numba.
+"""
+
+import numpy as np
+from numba import njit, prange
+
+
+@njit(cache=True)
+def _reflect_index(idx, n):
+    """Map an out-of-range index back into [0, n) like ndimage's 'reflect' mode."""
+    while idx < 0 or idx >= n:
+        if idx < 0:
+            idx = -idx - 1
+        else:
+            idx = 2 * n - idx - 1
+    return idx
+
+@njit(parallel=True, fastmath=True, cache=True)
+def variance(img):
+    """Two-pass variance of the whole image, accumulated in float64."""
+    total = 0.0
+    for i in prange(img.shape[0]):
+        for j in range(img.shape[1]):
+            total += img[i, j]
+    mean = total / img.size
+    sq_total = 0.0
+    for i in prange(img.shape[0]):
+        for j in range(img.shape[1]):
+            d = img[i, j] - mean
+            sq_total += d * d
+    return sq_total / img.size
+
+@njit(parallel=True, fastmath=True, cache=True)
+def lee(img, size, overall_variance, row_mean, row_sqr, out):
+    """Box means via running sums and the Lee weighting in one kernel."""
+    rows, cols = img.shape
+    half = size // 2
+    scale = 1.0 / size
+    
+    # 1. Horizontal running sums of the values and their squares
+    for i in prange(rows):
+        acc = 0.0
+        acc_sq = 0.0
+        for k in range(-half, size - half):
+            v = img[i, _reflect_index(k, cols)]
+            acc += v
+            acc_sq += v * v
+        row_mean[i, 0] = acc * scale
+        row_sqr[i, 0] = acc_sq * scale
+        for j in range(1, cols):
+            v_in = img[i, _reflect_index(j + size - half - 1, cols)]
+            v_out = img[i, _reflect_index(j - half - 1, cols)]
+            acc += v_in - v_out
+            acc_sq += v_in * v_in - v_out * v_out
+            row_mean[i, j] = acc * scale
+            row_sqr[i, j] = acc_sq * scale
+    
+    # 2. Vertical pass fused with the variance, weights and output
+    for i in prange(rows):
+        for j in range(cols):
+            mean = 0.0
+            sq_mean = 0.0
+            for k in range(-half, size - half):
+                r = _reflect_index(i + k, rows)
+                mean += row_mean[r, j]
+                sq_mean += row_sqr[r, j]
+            mean *= scale
+            sq_mean *= scale
+            variance = sq_mean - mean * mean
+            weight = variance / (variance + overall_variance)
+            out[i, j] = mean + weight * (img[i, j] - mean)
+
+@njit(parallel=True, fastmath=True, cache=True)
+def min_max(data):
+    """Minimum and maximum of a 2-D array in one pass."""
+    lo = np.inf
+    hi = -np.inf
+    for i in prange(data.shape[0]):
+        for j in range(data.shape[1]):
+            lo = min(lo, data[i, j])
+            hi = max(hi, data[i, j])
+    return lo, hi
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def decibels(data, out):
+    """Write 10*log10(data + 1e-10) to out and return the sum and sum of squares."""
+    total = 0.0
+    sq_total = 0.0
+    for i in prange(data.shape[0]):
+        for j in range(data.shape[1]):
+            value = np.float32(10.0 * np.log10(data[i, j] + 1e-10))
+            out[i, j] = value
+            total += value
+            sq_total += value * value
+    return total, sq_total
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def threshold_mask(data, threshold, out):
+    """Write 1 where data exceeds the threshold, 0 elsewhere."""
+    for i in prange(data.shape[0]):
+        row = data[i]
+        for j in range(data.shape[1]):
+            out[i, j] = 1 if row[j] > threshold else 0
+
+@njit(parallel=True, fastmath=True, cache=True)
+def sobel_magnitude(data, out):
+    """Sobel gradient magnitude with 'reflect' borders; returns its maximum."""
+    rows, cols = data.shape
+    peak = 0.0
+    for i in prange(rows):
+        r0 = _reflect_index(i - 1, rows)
+        r2 = _reflect_index(i + 1, rows)
+        for j in range(cols):
+            c0 = _reflect_index(j - 1, cols)
+            c2 = _reflect_index(j + 1, cols)
+            # Load as floats so unsigned input cannot wrap around
+            top_left, top, top_right = float(data[r0, c0]), float(data[r0, j]), float(data[r0, c2])
+            left, right = float(data[i, c0]), float(data[i, c2])
+            bottom_left, bottom, bottom_right = float(data[r2, c0]), float(data[r2, j]), float(data[r2, c2])
+            gx = (top_right - top_left) + 2.0 * (right - left) + (bottom_right - bottom_left)
+            gy = (bottom_left - top_left) + 2.0 * (bottom - top) + (bottom_right - top_right)
+            magnitude = np.sqrt(gx * gx + gy * gy)
+            out[i, j] = magnitude
+            peak = max(peak, magnitude)
+    return peak
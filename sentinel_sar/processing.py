@@ -3,37 +3,90 @@ Processing functions for SAR data.
 """
 
 import os
+import io
+import asyncio
+import fnmatch
+import shutil
+import zipfile
+import hashlib
+import heapq
+import tempfile
 import datetime
 import logging
 import numpy as np
-from sentinelsat import read_geojson, geojson_to_wkt
-import rasterio
-from rasterio.errors import RasterioIOError
-from scipy import ndimage
-from shapely.geometry import box
-import geopandas as gpd
 import requests
 import traceback
-from typing import Optional, Dict, List
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from typing import Optional, Dict, Iterator, List, Tuple, Union, TYPE_CHECKING
+
+from sentinel_sar.session import get_session, HTTP_TIMEOUT, DOWNLOAD_TIMEOUT, MAX_PARALLEL_DOWNLOADS
+from sentinel_sar.auth import authenticate
+from sentinel_sar.cache import make_cache_key, cache_get, cache_set
+from sentinel_sar.utils import json_loads, load_json_items, downsample_array, numba_kernels, numexpr_module, STREAM_JSON
+
+if TYPE_CHECKING:
+    from rasterio.windows import Window
+
+# rasterio and scipy are imported where they are used, and the Numba
+# kernels on first use, so searching and downloading never pay for
+# loading GDAL, the SciPy extensions or the JIT compiler
 
 logger = logging.getLogger(__name__)
 
+# Seconds a catalogue search response is reused for identical queries
+SEARCH_CACHE_TTL = 3600
+
+# RESTO OpenSearch endpoint and the query parameters that never change
+_SEARCH_URL = "https://catalogue.dataspace.copernicus.eu/resto/api/collections/Sentinel1/search.json"
+_BASE_SEARCH_PARAMS = {
+    'productType': 'SLC',
+    'status': 'ONLINE',
+}
+
+# Block size used when streaming downloads to disk
+DOWNLOAD_CHUNK_SIZE = 1 << 20
+
+_DOWNLOAD_URL = "https://catalogue.dataspace.copernicus.eu/resto/collections/Sentinel1/{product_id}/download"
+
+# Longest side, in pixels, of rasters read for display
+DISPLAY_MAX_SIZE = 2048
+
+# Speckle filter window, and the tiling used for scenes too large for memory
+LEE_FILTER_SIZE = 5
+TILE_SIZE = 2048
+TILED_PROCESSING_PIXELS = 4096 * 4096
+
+# Total size of the preprocessed array cache before the least recently used
+# files are removed
+PREPROCESSED_CACHE_MAX_BYTES = int(os.getenv('SENTINEL_SAR_ARRAY_CACHE_BYTES', 10 * 1024 ** 3))
+
+# Edge pixels sampled to estimate a percentile threshold
+PERCENTILE_SAMPLE_SIZE = 1_000_000
+
+# Structuring elements for closing edges and removing noise in feature detection
+_SE3 = np.ones((3, 3), dtype=bool)
+_SE2 = np.ones((2, 2), dtype=bool)
+
+# ZIP members needed for metadata-only workflows
+_ANNOTATION_PATTERNS = ('*/annotation/*.xml', '*/preview/*')
+
+# Decimal places kept in AOI coordinates (about 0.1 m), so that tiny float
+# differences map to the same footprint and cache entries
+AOI_DECIMALS = 6
+
+@lru_cache(maxsize=1024)
+def _wkt_from_bbox(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> str:
+    """Return the WKT polygon of a bounding box, in the vertex order of shapely's box()."""
+    return (f"POLYGON (({max_lon} {min_lat}, {max_lon} {max_lat}, {min_lon} {max_lat}, "
+            f"{min_lon} {min_lat}, {max_lon} {min_lat}))")
+
 def create_aoi_from_coordinates(analyzer, min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> str:
     """Create an Area of Interest (AOI) from coordinates."""
     try:
-        # Create a bounding box
-        bbox = box(min_lon, min_lat, max_lon, max_lat)
-        
-        # Convert to GeoDataFrame
-        geo_df = gpd.GeoDataFrame({'geometry': [bbox]}, crs='EPSG:4326')
-        
-        # Save to a temporary GeoJSON file
-        temp_geojson = analyzer.download_path / 'temp_aoi.geojson'
-        geo_df.to_file(temp_geojson, driver='GeoJSON')
-        
-        # Convert to WKT
-        footprint = geojson_to_wkt(read_geojson(str(temp_geojson)))
-        return footprint
+        return _wkt_from_bbox(*(round(float(value), AOI_DECIMALS)
+                                for value in (min_lon, min_lat, max_lon, max_lat)))
     except Exception as e:
         logger.error(f"Error creating AOI: {e}")
         return ""
@@ -42,62 +95,103 @@ def search_sar_data(analyzer, footprint: str, start_date: str, end_date: str,
                    platform_name: str = 'Sentinel-1', orbit_direction: str = 'ASCENDING',
                    sensor_mode: str = 'IW') -> Dict:
     """Search for SAR data within the specified parameters."""
+    products = _search_products(analyzer, footprint, start_date, end_date,
+                                platform_name, orbit_direction, sensor_mode)
+    if products:
+        analyzer.products = products
+    return products
+
+def _search_products(analyzer, footprint: str, start_date: str, end_date: str,
+                     platform_name: str = 'Sentinel-1', orbit_direction: str = 'ASCENDING',
+                     sensor_mode: str = 'IW', retry_auth: bool = True) -> Dict:
+    """Run a catalogue search and return its products without touching `analyzer.products`.
+    
+    Concurrent searches on one analyzer (`analyze_area_async`) use this
+    directly, so one area can never pick up another area's results. A
+    rejected token (401/403) is evicted from the cache and the search is
+    retried once with a fresh one.
+    """
     try:
         # Check if API token is available
         if not analyzer.api:
             logger.error("API token not available. Call authenticate() first.")
             return {}
+        
+        # Reuse a recent catalogue response for the same query
+        cache_key = make_cache_key(footprint, start_date, end_date, platform_name, orbit_direction, sensor_mode)
+        cached_products = cache_get('searches', cache_key)
+        if cached_products is not None:
+            logger.info(f"Found {len(cached_products)} products (cached)")
+            return cached_products
             
         # Convert string dates to datetime objects
         start = datetime.datetime.strptime(start_date, '%Y%m%d').date()
         end = datetime.datetime.strptime(end_date, '%Y%m%d').date()
         
-        # Use the correct OpenSearch API endpoint
-        search_url = "https://catalogue.dataspace.copernicus.eu/resto/api/collections/Sentinel1/search.json"
-        
         # Create the search parameters with correct parameter names
         params = {
-            'productType': 'SLC',
+            **_BASE_SEARCH_PARAMS,
             'geometry': footprint,
-            'startDate': f'{start.isoformat()}',
-            'completionDate': f'{end.isoformat()}',
+            'startDate': start.isoformat(),
+            'completionDate': end.isoformat(),
             'orbitDirection': orbit_direction,
             'sensorMode': sensor_mode,
-            'status': 'ONLINE',
         }
         
-        # Set up headers with the token
+        # Set up headers with the token; JSON compresses well, and any
+        # session (shared or the caller's) decompresses it transparently
         headers = {
             'Authorization': f'Bearer {analyzer.api}',
-            'Accept': 'application/json'
+            'Accept': 'application/json',
+            'Accept-Encoding': 'gzip, deflate'
         }
         
         # Log the request details for debugging
-        logger.info(f"Making request to: {search_url}")
+        logger.info(f"Making request to: {_SEARCH_URL}")
         logger.info(f"Search parameters: {params}")
         logger.info(f"Using token: {analyzer.api[:10]}...{analyzer.api[-10:] if len(analyzer.api) > 20 else ''}")
         
-        # Make the search request
-        response = requests.get(search_url, params=params, headers=headers)
+        # Make the search request; with ijson the features are parsed as they arrive
+        with get_session(analyzer).get(_SEARCH_URL, params=params, headers=headers,
+                                       timeout=HTTP_TIMEOUT, stream=STREAM_JSON) as response:
+            if response.status_code == 200:
+                # RESTO API format has a different structure
+                if STREAM_JSON:
+                    response.raw.decode_content = True
+                    products = load_json_items(response.raw, 'features.item')
+                else:
+                    products = json_loads(response.content).get('features', [])
+            # Error bodies are small, read them before the connection is released
+            response_text = response.text if response.status_code != 200 else ''
         
         if response.status_code == 200:
-            products_data = response.json()
-            # RESTO API format has a different structure
-            analyzer.products = products_data.get('features', [])
-            logger.info(f"Found {len(analyzer.products)} products")
-            return analyzer.products
+            cache_set('searches', cache_key, products, SEARCH_CACHE_TTL)
+            logger.info(f"Found {len(products)} products")
+            return products
         elif response.status_code == 400:
-            logger.error(f"Bad request (400): {response.json().get('detail', {}).get('ErrorMessage', 'Unknown error')}")
-            logger.error(f"Response: {response.text}")
+            # Parse the error body once; it is not always JSON
+            try:
+                error_data = json_loads(response.content)
+            except ValueError:
+                error_data = {}
+            error_detail = error_data.get('detail', {}) if isinstance(error_data, dict) else {}
+            error_message = error_detail.get('ErrorMessage', 'Unknown error') if isinstance(error_detail, dict) else error_detail
+            logger.error(f"Bad request (400): {error_message}")
+            logger.error(f"Response: {response_text}")
             return {}
-        elif response.status_code == 403:
-            logger.error("Authentication failed (403 Forbidden). Your token may be invalid or expired.")
-            logger.error(f"Response: {response.text}")
-            logger.info("Try re-authenticating to get a fresh token.")
+        elif response.status_code in (401, 403):
+            # A cached token can be revoked before it expires; get a new one once
+            if retry_auth:
+                logger.warning(f"Token rejected ({response.status_code}), re-authenticating")
+                if authenticate(analyzer, force=True):
+                    return _search_products(analyzer, footprint, start_date, end_date, platform_name,
+                                            orbit_direction, sensor_mode, retry_auth=False)
+            logger.error(f"Authentication failed ({response.status_code}). Your token may be invalid or expired.")
+            logger.error(f"Response: {response_text}")
             return {}
         else:
             logger.error(f"Search failed with status code: {response.status_code}")
-            logger.error(f"Response: {response.text}")
+            logger.error(f"Response: {response_text}")
             return {}
             
     except Exception as e:
@@ -106,81 +200,385 @@ def search_sar_data(analyzer, footprint: str, start_date: str, end_date: str,
         return {}
 
 
+def _select_products(products: List[Dict], limit: int) -> List[Dict]:
+    """Return the most recently published products up to the limit."""
+    # The products are now in a different format from the RESTO API
+    # Pick the latest by ingestion date if available; same result as sorting
+    # in reverse and slicing, in O(N log limit)
+    return heapq.nlargest(
+        limit,
+        products,
+        key=lambda x: x.get('properties', {}).get('published', '')
+    )
 
-def download_products(analyzer, limit: int = 1) -> List[str]:
-    """Download the found products."""
-    if not analyzer.products or len(analyzer.products) == 0:
-        logger.warning("No products to download. Run search_sar_data first.")
-        return []
+def _prepare_download(analyzer, product: Dict) -> Optional[Tuple[str, Dict, Path, Path, int]]:
+    """Work out how to fetch a product.
     
+    Returns (download_url, headers, file_path, part_path, resume_from), or
+    None if the product has no ID.
+    """
+    # Get product ID and download URL
+    product_id = product.get('id')
+    product_title = product.get('properties', {}).get('title')
+    
+    if not product_id:
+        logger.warning(f"Could not find ID for product: {product_title}")
+        return None
+    
+    # Construct download URL
+    download_url = _DOWNLOAD_URL.format(product_id=product_id)
+    
+    # Set up headers with the token; zips do not compress further, and an
+    # unencoded body keeps Range offsets equal to the bytes on disk
+    headers = {
+        'Authorization': f'Bearer {analyzer.api}',
+        'Accept': 'application/json',
+        'Accept-Encoding': 'identity'
+    }
+    
+    # Create a file path; data goes to a .part file until it is complete
+    file_path = analyzer.download_path / f"{product_title}.zip"
+    part_path = analyzer.download_path / f"{product_title}.zip.part"
+    
+    # Continue an interrupted download where it stopped
+    resume_from = part_path.stat().st_size if part_path.exists() else 0
+    if resume_from:
+        headers['Range'] = f'bytes={resume_from}-'
+    
+    return download_url, headers, file_path, part_path, resume_from
+
+def _part_file_mode(status_code: int, content_range: str, resume_from: int) -> str:
+    """Append only if the server resumed at the expected offset, otherwise start over."""
+    if status_code == 206 and resume_from > 0 and content_range.startswith(f'bytes {resume_from}-'):
+        return 'ab'
+    return 'wb'
+
+def _expected_md5(product: Dict) -> Optional[str]:
+    """MD5 the catalogue reports for a product, if any (OData or RESTO style)."""
+    for checksum in product.get('Checksum') or []:
+        if str(checksum.get('Algorithm', '')).upper() == 'MD5' and checksum.get('Value'):
+            return str(checksum['Value']).lower()
+    download = product.get('properties', {}).get('services', {}).get('download', {})
+    checksum = download.get('checksum')
+    if isinstance(checksum, str) and checksum:
+        return checksum.split(':', 1)[-1].lower()
+    return None
+
+def _verify_download(product: Dict, path: Path, check_md5: bool = True) -> bool:
+    """Check a file against the size and MD5 the catalogue reports, where it reports them."""
+    download = product.get('properties', {}).get('services', {}).get('download', {})
+    expected_size = download.get('size')
+    if expected_size and path.stat().st_size != int(expected_size):
+        logger.error(f"Size mismatch for {path.name}: {path.stat().st_size} != {expected_size} bytes")
+        return False
+    
+    expected_md5 = _expected_md5(product) if check_md5 else None
+    if expected_md5:
+        digest = hashlib.md5()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b''):
+                digest.update(block)
+        if digest.hexdigest() != expected_md5:
+            logger.error(f"MD5 mismatch for {path.name}")
+            return False
+    return True
+
+def _finish_download(product: Dict, part_path: Path, file_path: Path) -> Optional[str]:
+    """Verify a completed .part file and move it into place; a corrupt one is removed."""
+    if not _verify_download(product, part_path):
+        part_path.unlink(missing_ok=True)
+        return None
+    os.replace(part_path, file_path)
+    logger.info(f"Successfully downloaded: {file_path}")
+    return str(file_path)
+
+def _existing_download(product: Dict, file_path: Path) -> Optional[str]:
+    """Return an earlier download if it has the expected size, dropping a truncated one."""
+    if not file_path.exists():
+        return None
+    # Only the cheap size check here, so re-runs never re-hash large products
+    if not _verify_download(product, file_path, check_md5=False):
+        logger.warning(f"Discarding incomplete download: {file_path}")
+        file_path.unlink()
+        return None
+    logger.info(f"Product already downloaded: {file_path}")
+    return str(file_path)
+
+def _download_product(analyzer, product: Dict) -> Optional[str]:
+    """Download a single product and return the path of the saved file."""
     try:
-        # Check if API is authenticated
-        if analyzer.api is None:
-            logger.error("API not authenticated. Call authenticate() first.")
-            return []
+        download = _prepare_download(analyzer, product)
+        if download is None:
+            return None
+        download_url, headers, file_path, part_path, resume_from = download
+        
+        existing = _existing_download(product, file_path)
+        if existing:
+            return existing
+        if resume_from:
+            logger.info(f"Resuming download of {file_path.name} from byte {resume_from}")
+        else:
+            logger.info(f"Downloading product: {file_path.stem}")
+        
+        # Make the download request; the context manager returns the connection to the pool
+        with get_session(analyzer).get(download_url, headers=headers, stream=True,
+                                       timeout=DOWNLOAD_TIMEOUT) as response:
+            if resume_from and response.status_code == 416:
+                # Nothing left past the end of the partial file
+                return _finish_download(product, part_path, file_path)
             
-        # The products are now in a different format from the RESTO API
-        # Sort products by ingestion date if available
-        sorted_products = sorted(
-            analyzer.products,
-            key=lambda x: x.get('properties', {}).get('published', ''),
-            reverse=True
-        )
+            if response.status_code not in (200, 206):
+                logger.error(f"Download failed with status code: {response.status_code}")
+                logger.error(f"Response: {response.text}")
+                return None
+            
+            mode = _part_file_mode(response.status_code, response.headers.get('Content-Range', ''), resume_from)
+            
+            # Stream the raw socket to disk in 1 MiB blocks; decode_content
+            # still undoes any Content-Encoding the server applied
+            response.raw.decode_content = True
+            with open(part_path, mode, buffering=DOWNLOAD_CHUNK_SIZE) as f:
+                shutil.copyfileobj(response.raw, f, length=DOWNLOAD_CHUNK_SIZE)
         
-        # Select the most recent products up to the limit
-        products_to_download = sorted_products[:limit]
+        return _finish_download(product, part_path, file_path)
+    
+    except Exception as e:
+        logger.error(f"Error downloading product {product.get('properties', {}).get('title')}: {e}")
+        return None
+
+async def _download_product_async(analyzer, http, product: Dict, download_slots) -> Optional[str]:
+    """aiohttp version of `_download_product`, writing the same .part files."""
+    loop = asyncio.get_running_loop()
+    try:
+        download = _prepare_download(analyzer, product)
+        if download is None:
+            return None
+        download_url, headers, file_path, part_path, resume_from = download
         
-        file_paths = []
-        for product in products_to_download:
-            try:
-                # Get product ID and download URL
-                product_id = product.get('id')
-                product_title = product.get('properties', {}).get('title')
-                
-                if not product_id:
-                    logger.warning(f"Could not find ID for product: {product_title}")
-                    continue
-                
-                # Construct download URL
-                download_url = f"https://catalogue.dataspace.copernicus.eu/resto/collections/Sentinel1/{product_id}/download"
-                
-                # Set up headers with the token
-                headers = {
-                    'Authorization': f'Bearer {analyzer.api}',
-                    'Accept': 'application/json'
-                }
-                
-                logger.info(f"Downloading product: {product_title}")
+        existing = _existing_download(product, file_path)
+        if existing:
+            return existing
+        
+        async with download_slots:
+            logger.info(f"Downloading product: {file_path.stem}")
+            async with http.get(download_url, headers=headers) as response:
+                if resume_from and response.status == 416:
+                    return await loop.run_in_executor(None, _finish_download, product, part_path, file_path)
                 
-                # Make the download request
-                response = requests.get(download_url, headers=headers, stream=True)
+                if response.status not in (200, 206):
+                    logger.error(f"Download failed with status code: {response.status}")
+                    logger.error(f"Response: {await response.text()}")
+                    return None
                 
-                if response.status_code == 200:
-                    # Create a file path
-                    file_path = analyzer.download_path / f"{product_title}.zip"
-                    
-                    # Download the file
-                    with open(file_path, 'wb') as f:
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                    
-                    logger.info(f"Successfully downloaded: {file_path}")
-                    file_paths.append(str(file_path))
-                else:
-                    logger.error(f"Download failed with status code: {response.status_code}")
-                    logger.error(f"Response: {response.text}")
-            
-            except Exception as e:
-                logger.error(f"Error downloading product {product.get('properties', {}).get('title')}: {e}")
+                mode = _part_file_mode(response.status, response.headers.get('Content-Range', ''), resume_from)
+                # Disk writes run on the executor, so a slow disk never stalls
+                # the other downloads on the event loop
+                f = await loop.run_in_executor(None, open, part_path, mode)
+                try:
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        await loop.run_in_executor(None, f.write, chunk)
+                finally:
+                    await loop.run_in_executor(None, f.close)
+        
+        # Hashing gigabytes would stall the event loop, so it runs on a thread
+        return await loop.run_in_executor(None, _finish_download, product, part_path, file_path)
+    
+    except Exception as e:
+        logger.error(f"Error downloading product {product.get('properties', {}).get('title')}: {e}")
+        return None
+
+def _products_to_download(analyzer, limit: int, products: Optional[List[Dict]]) -> List[Dict]:
+    """Check the download preconditions and return the products to fetch."""
+    if products is None:
+        products = analyzer.products
+    if not products or len(products) == 0:
+        logger.warning("No products to download. Run search_sar_data first.")
+        return []
+    
+    # Check if API is authenticated
+    if analyzer.api is None:
+        logger.error("API not authenticated. Call authenticate() first.")
+        return []
+    
+    return _select_products(products, limit)
+
+def _download_workers(analyzer) -> int:
+    """Return the number of parallel downloads to run for the analyzer."""
+    return max(1, analyzer.download_workers or MAX_PARALLEL_DOWNLOADS)
+
+def download_products(analyzer, limit: int = 1, products: Optional[List[Dict]] = None) -> List[str]:
+    """Download the found products, or the given products instead of the last search results."""
+    try:
+        products_to_download = _products_to_download(analyzer, limit, products)
+        if not products_to_download:
+            return []
+        
+        # Download in parallel, capped to the CDSE concurrent download quota
+        max_workers = min(len(products_to_download), _download_workers(analyzer))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(
+                lambda product: _download_product(analyzer, product),
+                products_to_download
+            ))
+        
+        return [file_path for file_path in results if file_path]
+    except Exception as e:
+        logger.error(f"Error downloading products: {e}")
+        logger.debug(f"Detailed error: {traceback.format_exc()}")
+        return []
+
+def iter_download_products(analyzer, limit: int = 1, products: Optional[List[Dict]] = None) -> Iterator[str]:
+    """Download the found products, yielding each file path as soon as it is saved.
+    
+    Downloads keep running in the background while the caller works on the
+    files already yielded.
+    """
+    try:
+        products_to_download = _products_to_download(analyzer, limit, products)
+        if not products_to_download:
+            return
+        
+        max_workers = min(len(products_to_download), _download_workers(analyzer))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(_download_product, analyzer, product)
+                for product in products_to_download
+            ]
+            for future in as_completed(futures):
+                file_path = future.result()
+                if file_path:
+                    yield file_path
+    except Exception as e:
+        logger.error(f"Error downloading products: {e}")
+        logger.debug(f"Detailed error: {traceback.format_exc()}")
+
+async def download_products_async(analyzer, limit: int = 1, products: Optional[List[Dict]] = None) -> List[str]:
+    """Download the found products without blocking the event loop.
+    
+    Uses aiohttp when it is installed; otherwise runs `download_products`
+    in the default executor. Unlike the shared session, aiohttp does not
+    retry failed requests, but a later call resumes from the .part file.
+    """
+    # Imported here so importing the package never pays for aiohttp
+    try:
+        import aiohttp
+    except ImportError:
+        aiohttp = None
+    
+    if aiohttp is None:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, download_products, analyzer, limit, products)
+    
+    try:
+        products_to_download = _products_to_download(analyzer, limit, products)
+        if not products_to_download:
+            return []
+        
+        download_slots = asyncio.Semaphore(_download_workers(analyzer))
+        timeout = aiohttp.ClientTimeout(sock_connect=DOWNLOAD_TIMEOUT[0], sock_read=DOWNLOAD_TIMEOUT[1])
+        async with aiohttp.ClientSession(timeout=timeout) as http:
+            results = await asyncio.gather(*(
+                _download_product_async(analyzer, http, product, download_slots)
+                for product in products_to_download
+            ))
         
-        return file_paths
+        return [file_path for file_path in results if file_path]
     except Exception as e:
         logger.error(f"Error downloading products: {e}")
         logger.debug(f"Detailed error: {traceback.format_exc()}")
         return []
 
 
+class _HTTPRangeFile(io.RawIOBase):
+    """Read-only, seekable file object backed by HTTP Range requests."""
+    
+    def __init__(self, session: requests.Session, url: str, headers: Dict):
+        self._session = session
+        # An unencoded body keeps the Range offsets and sizes in plain bytes
+        self._headers = {**headers, 'Accept-Encoding': 'identity'}
+        self._pos = 0
+        
+        # Probe the size with a one-byte request and keep the redirect target
+        response = session.get(url, headers={**self._headers, 'Range': 'bytes=0-0'}, stream=True, timeout=HTTP_TIMEOUT)
+        response.close()
+        if response.status_code != 206:
+            raise IOError(f"Range requests not supported (status code: {response.status_code})")
+        self._url = response.url
+        self._size = int(response.headers['Content-Range'].rsplit('/', 1)[1])
+    
+    def readable(self) -> bool:
+        return True
+    
+    def seekable(self) -> bool:
+        return True
+    
+    def tell(self) -> int:
+        return self._pos
+    
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self._size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._pos
+    
+    def readinto(self, buffer) -> int:
+        if self._pos >= self._size:
+            return 0
+        end = min(self._pos + len(buffer), self._size) - 1
+        response = self._session.get(self._url, headers={**self._headers, 'Range': f'bytes={self._pos}-{end}'}, timeout=HTTP_TIMEOUT)
+        response.raise_for_status()
+        data = response.content
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+def download_annotations(analyzer, limit: int = 1) -> List[str]:
+    """Extract only the annotation and preview files of the found products.
+    
+    The remote ZIP is read through HTTP Range requests, so only the central
+    directory and the selected members are transferred.
+    """
+    if not analyzer.products or len(analyzer.products) == 0:
+        logger.warning("No products to download. Run search_sar_data first.")
+        return []
+    
+    if analyzer.api is None:
+        logger.error("API not authenticated. Call authenticate() first.")
+        return []
+    
+    headers = {'Authorization': f'Bearer {analyzer.api}'}
+    
+    file_paths = []
+    for product in _select_products(analyzer.products, limit):
+        product_id = product.get('id')
+        product_title = product.get('properties', {}).get('title')
+        if not product_id:
+            logger.warning(f"Could not find ID for product: {product_title}")
+            continue
+        
+        try:
+            logger.info(f"Reading annotations of product: {product_title}")
+            remote = _HTTPRangeFile(get_session(analyzer), _DOWNLOAD_URL.format(product_id=product_id), headers)
+            with zipfile.ZipFile(io.BufferedReader(remote, buffer_size=1 << 20)) as zf:
+                members = [
+                    name for name in zf.namelist()
+                    if any(fnmatch.fnmatch(name, pattern) for pattern in _ANNOTATION_PATTERNS)
+                ]
+                extract_dir = analyzer.download_path / str(product_title)
+                for name in members:
+                    file_paths.append(zf.extract(name, path=extract_dir))
+            logger.info(f"Extracted {len(members)} annotation files to {extract_dir}")
+        except Exception as e:
+            logger.error(f"Error reading annotations for product {product_title}: {e}")
+            logger.debug(f"Detailed error: {traceback.format_exc()}")
+    
+    return file_paths
+
 
 def process_sentinel1_data(analyzer, file_path: str) -> Optional[str]:
     """Process Sentinel-1 specific data format."""
@@ -192,53 +590,466 @@ def process_sentinel1_data(analyzer, file_path: str) -> Optional[str]:
         return None
 
 
-def _lee_filter(img: np.ndarray, size: int) -> np.ndarray:
-    """Apply Lee filter for speckle reduction."""
-    img_mean = ndimage.uniform_filter(img, size=size)
-    img_sqr_mean = ndimage.uniform_filter(img**2, size=size)
-    img_variance = img_sqr_mean - img_mean**2
+def convert_to_cog(analyzer, file_path: str) -> Optional[str]:
+    """Convert a raster to a tiled Cloud-Optimized GeoTIFF with overviews, once."""
+    try:
+        import rasterio.shutil
+        
+        cog_path = analyzer.download_path / f"{Path(file_path).stem}.cog.tif"
+        
+        # Reuse a previous conversion unless the source changed since
+        if cog_path.exists() and cog_path.stat().st_mtime >= os.path.getmtime(file_path):
+            logger.info(f"Using existing COG: {cog_path}")
+            return str(cog_path)
+        
+        logger.info(f"Converting {file_path} to COG...")
+        # Write to a unique sibling and move it into place, so a crash or a
+        # concurrent run never leaves a truncated COG that would be reused
+        fd, tmp_path = tempfile.mkstemp(prefix=f"{cog_path.stem}.", suffix='.tmp.tif', dir=cog_path.parent)
+        os.close(fd)
+        try:
+            rasterio.shutil.copy(
+                file_path,
+                tmp_path,
+                driver='COG',
+                compress='DEFLATE',
+                blocksize=512,
+                overview_resampling='average',
+                num_threads='ALL_CPUS'
+            )
+            os.replace(tmp_path, cog_path)
+        except BaseException:
+            Path(tmp_path).unlink(missing_ok=True)
+            raise
+        logger.info(f"COG saved to {cog_path}")
+        return str(cog_path)
+    except Exception as e:
+        logger.error(f"Error converting to COG: {e}")
+        return None
+
+
+def _min_max(data: np.ndarray) -> Tuple[float, float]:
+    """Return (min, max) of the data, in a single pass when Numba is available."""
+    kernels = numba_kernels()
+    if kernels is not None and data.ndim == 2:
+        lo, hi = kernels.min_max(data)
+        return float(lo), float(hi)
+    return float(data.min()), float(data.max())
+
+def _lee_buffers(shape: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Allocate the three float32 buffers `_lee_filter` works in."""
+    return tuple(np.empty(shape, dtype=np.float32) for _ in range(3))
+
+def _lee_filter(img: np.ndarray, size: int, overall_variance: Optional[float] = None,
+                buffers: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None) -> np.ndarray:
+    """Apply Lee filter for speckle reduction.
+    
+    Works in float32; uses the Numba kernel when available and otherwise
+    reuses three scratch buffers for the SciPy arithmetic. Pass the
+    `overall_variance` of the whole scene when filtering a single tile,
+    and `buffers` from `_lee_buffers` to reuse them across calls; the
+    result is then the last buffer, valid until the next call.
+    """
+    img = np.ascontiguousarray(img, dtype=np.float32)
+    if buffers is None:
+        buffers = _lee_buffers(img.shape)
     
-    # Compute the local variance
-    overall_variance = np.var(img)
+    kernels = numba_kernels()
+    if kernels is not None and img.ndim == 2:
+        if overall_variance is None:
+            overall_variance = kernels.variance(img)
+        row_mean, row_sqr, output = buffers
+        kernels.lee(img, size, overall_variance, row_mean, row_sqr, output)
+        return output
     
-    # Lee filter
-    img_weights = img_variance / (img_variance + overall_variance)
-    img_output = img_mean + img_weights * (img - img_mean)
+    from scipy import ndimage
     
-    return img_output
+    img_mean, buffer, output = buffers
+    
+    # Local mean and local mean of squares, with the same borders as the Numba kernel
+    ndimage.uniform_filter(img, size=size, output=img_mean, mode='reflect')
+    np.multiply(img, img, out=buffer)
+    ndimage.uniform_filter(buffer, size=size, output=buffer, mode='reflect')
+    
+    # Compute the local variance (buffer) and the overall variance
+    np.multiply(img_mean, img_mean, out=output)
+    np.subtract(buffer, output, out=buffer)
+    if overall_variance is None:
+        overall_variance = float(img.var(dtype=np.float64))
+    
+    # Lee filter: weights = variance / (variance + overall_variance)
+    np.add(buffer, overall_variance, out=output)
+    np.divide(buffer, output, out=buffer)
+    
+    # output = mean + weights * (img - mean)
+    np.subtract(img, img_mean, out=output)
+    np.multiply(buffer, output, out=output)
+    np.add(output, img_mean, out=output)
+    
+    return output
+
+def _lee_filter_parallel(img: np.ndarray, size: int, overall_variance: Optional[float] = None) -> np.ndarray:
+    """Apply the Lee filter to horizontal strips on a thread pool.
+    
+    The Numba kernel already runs on all cores, so this only splits the
+    SciPy path; strips overlap by a halo, so the result is unchanged.
+    """
+    workers = os.cpu_count() or 1
+    if numba_kernels() is not None or workers == 1 or img.ndim != 2 or img.shape[0] < 2 * workers * size:
+        return _lee_filter(img, size, overall_variance)
+    
+    img = np.ascontiguousarray(img, dtype=np.float32)
+    if overall_variance is None:
+        overall_variance = float(img.var(dtype=np.float64))
+    output = np.empty_like(img)
+    halo = size // 2
+    bounds = np.linspace(0, img.shape[0], workers + 1).astype(int)
+    
+    def filter_strip(start: int, stop: int) -> None:
+        top = max(0, start - halo)
+        bottom = min(img.shape[0], stop + halo)
+        filtered = _lee_filter(img[top:bottom], size, overall_variance)
+        output[start:stop] = filtered[start - top:start - top + stop - start]
+    
+    # NumPy and SciPy release the GIL in their loops, so threads run in parallel
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(filter_strip, bounds[:-1], bounds[1:]))
+    
+    return output
+
+def get_aoi_window(src, bounds: Optional[Tuple[float, float, float, float]]) -> Optional['Window']:
+    """Return the raster window covering the AOI bounds (lon/lat), or None for the full raster."""
+    if bounds is None or src.crs is None:
+        return None
+    
+    from rasterio.errors import WindowError
+    from rasterio.warp import transform_bounds
+    from rasterio.windows import Window, from_bounds
+    
+    try:
+        # Bring the AOI into the raster CRS before mapping it to pixels
+        if src.crs.to_epsg() != 4326:
+            bounds = transform_bounds('EPSG:4326', src.crs, *bounds)
+        window = from_bounds(*bounds, transform=src.transform)
+        window = window.intersection(Window(0, 0, src.width, src.height))
+        return window.round_offsets().round_lengths()
+    except WindowError:
+        logger.warning("AOI does not overlap the raster, reading the full band")
+        return None
+
+def read_display_band(src, window: Optional['Window'] = None, max_size: int = DISPLAY_MAX_SIZE) -> np.ndarray:
+    """Read the first band at a resolution suited for display.
+    
+    The longest side is reduced to about `max_size` pixels; on COGs this is
+    served from the internal overviews instead of the full-resolution data.
+    """
+    from rasterio.enums import Resampling
+    
+    height = int(window.height) if window is not None else src.height
+    width = int(window.width) if window is not None else src.width
+    factor = max(1, max(width, height) // max_size)
+    return src.read(
+        1,
+        window=window,
+        out_shape=(max(1, height // factor), max(1, width // factor)),
+        resampling=Resampling.average
+    )
 
-def preprocess_sar_data(analyzer, file_path: str) -> Optional[np.ndarray]:
-    """Preprocess the SAR data for analysis."""
+def _preprocessed_cache_path(analyzer, file_path: str,
+                             bounds: Optional[Tuple[float, float, float, float]]) -> Path:
+    """Return the cache file for the preprocessed array of a raster and AOI."""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        digest.update(f.read(1 << 16))
+    # The filter size is part of the key, so changing it never serves stale arrays
+    digest.update(f"{os.path.getsize(file_path)}|{os.path.getmtime(file_path)}|{bounds}|"
+                  f"lee={LEE_FILTER_SIZE}".encode())
+    return analyzer.download_path / 'cache' / f"{digest.hexdigest()}.npy"
+
+def _save_preprocessed_cache(cache_path: Path, data: np.ndarray) -> None:
+    """Write a preprocessed array to the cache without leaving partial files."""
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Could not cache preprocessed data: {e}")
+
+@lru_cache(maxsize=1)
+def _uint16_db_table() -> np.ndarray:
+    """Decibel value of every possible uint16 pixel, as float32."""
+    return (10.0 * np.log10(np.arange(65536, dtype=np.float64) + 1e-10)).astype(np.float32)
+
+def _read_dtype(src) -> Optional[type]:
+    """dtype to read the first band in: uint16 stays native for the lookup table."""
+    return None if src.dtypes[0] == 'uint16' else np.float32
+
+def _to_decibels(data: np.ndarray, with_variance: bool = False) -> Union[np.ndarray, Tuple[np.ndarray, float]]:
+    """Convert the data to decibels in float32, in place if it already is float32.
+    
+    uint16 input (e.g. GRD backscatter) is mapped through a lookup table
+    instead of calling log10 per pixel. With `with_variance`, also returns
+    the variance of the result that the Lee filter needs.
+    """
+    kernels = numba_kernels() if data.dtype != np.uint16 else None
+    if kernels is not None and data.ndim == 2:
+        # One fused pass computes the dB values and their statistics
+        sar_db = data if data.dtype == np.float32 else np.empty(data.shape, dtype=np.float32)
+        total, sq_total = kernels.decibels(data, sar_db)
+        if not with_variance:
+            return sar_db
+        mean = total / sar_db.size
+        return sar_db, max(sq_total / sar_db.size - mean * mean, 0.0)
+    
+    numexpr = numexpr_module() if data.dtype != np.uint16 else None
+    if data.dtype == np.uint16:
+        sar_db = _uint16_db_table()[data]
+    elif numexpr is not None:
+        # numexpr fuses the three steps into one multi-threaded pass
+        sar_db = data if data.dtype == np.float32 else np.empty(data.shape, dtype=np.float32)
+        numexpr.evaluate('10 * log10(data + 1e-10)', local_dict={'data': data},
+                         out=sar_db, casting='same_kind')
+    else:
+        sar_db = data.astype(np.float32, copy=False)
+        np.add(sar_db, np.float32(1e-10), out=sar_db)  # Add small constant to avoid log(0)
+        # log2 has a vectorized float32 loop on more platforms than log10;
+        # the base change folds into the x10 scaling (10 * log10(2))
+        np.log2(sar_db, out=sar_db)
+        np.multiply(sar_db, np.float32(10 * np.log10(2)), out=sar_db)
+    
+    if with_variance:
+        return sar_db, float(sar_db.var(dtype=np.float64))
+    return sar_db
+
+def _iter_tiles(region: 'Window', tile_size: int) -> Iterator['Window']:
+    """Yield the tiles covering a window, in row-major order."""
+    from rasterio.windows import Window
+    
+    for row in range(0, region.height, tile_size):
+        for col in range(0, region.width, tile_size):
+            yield Window(region.col_off + col, region.row_off + row,
+                         min(tile_size, region.width - col), min(tile_size, region.height - row))
+
+def _buffered_tile(tile: 'Window', halo: int, region: 'Window') -> 'Window':
+    """Grow a tile by `halo` pixels on each side, without leaving the region."""
+    from rasterio.windows import Window
+    
+    col_start = max(region.col_off, tile.col_off - halo)
+    row_start = max(region.row_off, tile.row_off - halo)
+    col_stop = min(region.col_off + region.width, tile.col_off + tile.width + halo)
+    row_stop = min(region.row_off + region.height, tile.row_off + tile.height + halo)
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+
+def _preprocess_tiled(src, window: Optional['Window'], cache_path: Path) -> np.ndarray:
+    """Preprocess a large band tile by tile into a memory-mapped cache file.
+    
+    Peak memory is a few tiles instead of the whole scene. Each tile is
+    filtered with a halo, so the result matches the in-memory path.
+    """
+    from rasterio.windows import Window
+    
+    region = window if window is not None else Window(0, 0, src.width, src.height)
+    region = Window(int(region.col_off), int(region.row_off), int(region.width), int(region.height))
+    halo = LEE_FILTER_SIZE // 2
+    
+    # 1. Overall variance of the dB band, merging per-tile statistics
+    count, mean, m2 = 0, 0.0, 0.0
+    for tile in _iter_tiles(region, TILE_SIZE):
+        sar_db = _to_decibels(src.read(1, window=tile, out_dtype=_read_dtype(src)))
+        n = sar_db.size
+        tile_mean = float(sar_db.mean(dtype=np.float64))
+        delta = tile_mean - mean
+        total = count + n
+        mean += delta * n / total
+        m2 += float(sar_db.var(dtype=np.float64)) * n + delta * delta * count * n / total
+        count = total
+    overall_variance = m2 / count
+    
+    # 2. Lee filter each tile with its halo and write the core into the output
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = cache_path.with_suffix('.tmp')
+    try:
+        output = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float32,
+                                           shape=(region.height, region.width))
+        data_min, data_max = np.inf, -np.inf
+        lee_buffers = None
+        for tile in _iter_tiles(region, TILE_SIZE):
+            buffered = _buffered_tile(tile, halo, region)
+            # Tiles along a row share a shape, so the filter buffers are reused
+            shape = (int(buffered.height), int(buffered.width))
+            if lee_buffers is None or lee_buffers[0].shape != shape:
+                lee_buffers = _lee_buffers(shape)
+            filtered = _lee_filter(_to_decibels(src.read(1, window=buffered, out_dtype=_read_dtype(src))),
+                                   LEE_FILTER_SIZE, overall_variance, lee_buffers)
+            row = tile.row_off - buffered.row_off
+            col = tile.col_off - buffered.col_off
+            core = filtered[row:row + tile.height, col:col + tile.width]
+            output[tile.row_off - region.row_off:tile.row_off - region.row_off + tile.height,
+                   tile.col_off - region.col_off:tile.col_off - region.col_off + tile.width] = core
+            core_min, core_max = _min_max(core)
+            data_min = min(data_min, core_min)
+            data_max = max(data_max, core_max)
+        
+        # 3. Normalize in place, one strip of rows at a time
+        data_range = data_max - data_min
+        for row in range(0, region.height, TILE_SIZE):
+            strip = output[row:row + TILE_SIZE]
+            np.subtract(strip, np.float32(data_min), out=strip)
+            if data_range > 0:
+                np.multiply(strip, np.float32(1.0 / data_range), out=strip)
+        output.flush()
+        del output
+        
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    
+    return np.load(cache_path, mmap_mode='r')
+
+def _evict_preprocessed_cache(cache_dir: Path, max_bytes: int = PREPROCESSED_CACHE_MAX_BYTES) -> None:
+    """Remove the least recently used cached arrays until the cache fits in `max_bytes`."""
+    try:
+        entries = []
+        for entry in os.scandir(cache_dir):
+            if entry.name.endswith('.npy') and entry.is_file():
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            os.remove(path)
+            total -= size
+            logger.info(f"Evicted cached array: {path}")
+    except OSError as e:
+        logger.warning(f"Could not trim the preprocessed data cache: {e}")
+
+def _normalized_as(data: np.ndarray, dtype: Optional[type]) -> np.ndarray:
+    """Return normalized [0, 1] data as `dtype`; uint8 maps the range to 0-255.
+    
+    uint8 output is scaled one strip of rows at a time, so a memory-mapped
+    tiled result is never copied whole into float32.
+    """
+    if dtype is None or data.dtype == dtype:
+        return data
+    if np.dtype(dtype) == np.uint8:
+        output = np.empty(data.shape, dtype=np.uint8)
+        for row in range(0, data.shape[0], TILE_SIZE):
+            scaled = np.multiply(data[row:row + TILE_SIZE], np.float32(255))
+            np.add(scaled, np.float32(0.5), out=scaled)
+            output[row:row + TILE_SIZE] = scaled
+        return output
+    return data.astype(dtype)
+
+def preprocess_sar_data(analyzer, file_path: str,
+                        bounds: Optional[Tuple[float, float, float, float]] = None,
+                        return_original: bool = False,
+                        dtype: Optional[type] = None) -> Optional[Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]]:
+    """Preprocess the SAR data for analysis, optionally clipped to the AOI bounds.
+    
+    With `return_original`, returns `(processed, original)` where `original` is
+    the raw band downsampled for display, so callers need not reopen the file.
+    With `dtype=np.uint8` the processed band is returned scaled to 0-255,
+    a quarter of the float32 size.
+    """
+    result = _preprocess_sar_data(analyzer, file_path, bounds, return_original)
+    if result is None or dtype is None:
+        return result
+    if return_original:
+        return _normalized_as(result[0], dtype), result[1]
+    return _normalized_as(result, dtype)
+
+def _preprocess_sar_data(analyzer, file_path: str,
+                         bounds: Optional[Tuple[float, float, float, float]],
+                         return_original: bool) -> Optional[Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]]:
+    """Float32 preprocessing behind `preprocess_sar_data`, with its array cache."""
+    import rasterio
+    from rasterio.errors import RasterioIOError
+    
     try:
         # Check if the file exists
         if not os.path.exists(file_path):
             logger.error(f"Error: File does not exist at {file_path}")
             return None
         
+        # Reuse the result of a previous run on the same file and AOI
+        cache_path = _preprocessed_cache_path(analyzer, file_path, bounds)
+        original_cache_path = cache_path.with_suffix('.original.npy')
+        if cache_path.exists():
+            logger.info(f"Loading preprocessed data from cache: {cache_path}")
+            # The modification time doubles as the last-used time for eviction
+            os.utime(cache_path)
+            sar_normalized = np.load(cache_path, mmap_mode='r')
+            if not return_original:
+                return sar_normalized
+            if original_cache_path.exists():
+                os.utime(original_cache_path)
+                return sar_normalized, np.load(original_cache_path, mmap_mode='r')
+            with rasterio.open(file_path, NUM_THREADS='ALL_CPUS') as src:
+                return sar_normalized, read_display_band(src, get_aoi_window(src, bounds))
+        
         # Print file information for debugging
         logger.info(f"Attempting to process file: {file_path}")
         logger.info(f"File size: {os.path.getsize(file_path) / (1024*1024):.2f} MB")
         
         # Open the raster file
-        with rasterio.open(file_path) as src:
+        with rasterio.open(file_path, NUM_THREADS='ALL_CPUS') as src:
             # Print raster information for debugging
             logger.info(f"Raster shape: {src.shape}")
             logger.info(f"Raster bands: {src.count}")
             
-            # Read the data
-            sar_data = src.read(1)  # Read the first band
+            # Limit processing to the AOI window if given
+            window = get_aoi_window(src, bounds)
+            height = int(window.height) if window is not None else src.height
+            width = int(window.width) if window is not None else src.width
+            
+            # Large scenes are processed tile by tile straight into the cache
+            if height * width > TILED_PROCESSING_PIXELS:
+                logger.info("Processing the raster in tiles")
+                sar_normalized = _preprocess_tiled(src, window, cache_path)
+                original_data = read_display_band(src, window)
+                _save_preprocessed_cache(original_cache_path, original_data)
+                _evict_preprocessed_cache(cache_path.parent)
+                if return_original:
+                    return sar_normalized, original_data
+                return sar_normalized
             
-            # Apply preprocessing steps
+            # Read the first band straight into float32 (uint16 stays native)
+            sar_data = src.read(1, window=window, out_dtype=_read_dtype(src))
+            
+            # Keep a display-sized copy of the raw band before it is overwritten
+            original_data = downsample_array(sar_data, DISPLAY_MAX_SIZE)
+            if original_data is sar_data and sar_data.dtype == np.float32:
+                original_data = sar_data.copy()
+            
+            # Apply preprocessing steps in place on the float32 band
             # 1. Convert to decibels
-            sar_db = 10 * np.log10(sar_data + 1e-10)  # Add small constant to avoid log(0)
+            sar_db, overall_variance = _to_decibels(sar_data, with_variance=True)
+            del sar_data
             
             # 2. Apply speckle filtering (Lee filter)
-            sar_filtered = _lee_filter(sar_db, size=5)
+            sar_filtered = _lee_filter_parallel(sar_db, LEE_FILTER_SIZE, overall_variance)
+            del sar_db
             
             # 3. Normalize the data
-            sar_normalized = (sar_filtered - np.min(sar_filtered)) / (np.max(sar_filtered) - np.min(sar_filtered))
-            
-            return sar_normalized
+            data_min, data_max = _min_max(sar_filtered)
+            data_range = data_max - data_min
+            np.subtract(sar_filtered, np.float32(data_min), out=sar_filtered)
+            if data_range > 0:
+                np.multiply(sar_filtered, np.float32(1.0 / data_range), out=sar_filtered)
+            sar_normalized = sar_filtered
+        
+        _save_preprocessed_cache(cache_path, sar_normalized)
+        _save_preprocessed_cache(original_cache_path, original_data)
+        _evict_preprocessed_cache(cache_path.parent)
+        
+        if return_original:
+            return sar_normalized, original_data
+        return sar_normalized
     except RasterioIOError as e:
         logger.error(f"Rasterio IO Error: {e}")
         logger.error("This might be because the file is not a valid raster format or requires additional preprocessing.")
@@ -248,23 +1059,132 @@ def preprocess_sar_data(analyzer, file_path: str) -> Optional[np.ndarray]:
         logger.error(traceback.format_exc())
         return None
 
-def detect_subsurface_features(sar_data: np.ndarray, threshold: float = 0.7) -> Optional[np.ndarray]:
-    """Detect potential subsurface features in the SAR data."""
+def _percentile_threshold(edges: np.ndarray, percentile: float) -> float:
+    """Estimate a percentile of the edge strengths from an evenly strided sample.
+    
+    Selection with np.partition is O(n), and the sample keeps it near-constant
+    on large scenes; one outlier pixel cannot move the threshold.
+    """
+    flat = edges.reshape(-1)
+    sample = flat[::max(1, flat.size // PERCENTILE_SAMPLE_SIZE)]
+    k = int(round((sample.size - 1) * percentile / 100.0))
+    return float(np.partition(sample, k)[k])
+
+def _threshold_mask(data: np.ndarray, threshold: float) -> np.ndarray:
+    """Return a boolean mask of the values above the threshold."""
+    kernels = numba_kernels()
+    if kernels is not None and data.ndim == 2:
+        out = np.empty(data.shape, dtype=np.uint8)
+        kernels.threshold_mask(data, threshold, out)
+        return out.view(np.bool_)
+    return data > threshold
+
+def _detect_features_cv2(cv2, sar_data: np.ndarray, threshold: float,
+                         percentile: Optional[float] = None) -> np.ndarray:
+    """OpenCV version of the detection steps, with the same borders as SciPy."""
+    sar_data = np.ascontiguousarray(sar_data, dtype=np.uint8 if sar_data.dtype == np.uint8 else np.float32)
+    
+    # 1. Sobel gradient magnitude, with the 'reflect' border of ndimage
+    edges = cv2.magnitude(
+        cv2.Sobel(sar_data, cv2.CV_32F, 1, 0, ksize=3, borderType=cv2.BORDER_REFLECT),
+        cv2.Sobel(sar_data, cv2.CV_32F, 0, 1, ksize=3, borderType=cv2.BORDER_REFLECT)
+    )
+    
+    # 2. Apply thresholding to identify strong edges
+    if percentile is not None:
+        edge_threshold = _percentile_threshold(edges, percentile)
+    else:
+        edge_threshold = np.max(edges) * threshold
+    strong_edges = _threshold_mask(edges, edge_threshold).view(np.uint8)
+    
+    # 3. Closing with a 3x3 square; pixels outside the image count as background
+    square = _SE3.view(np.uint8)
+    connected_edges = cv2.erode(
+        cv2.dilate(strong_edges, square, borderType=cv2.BORDER_CONSTANT, borderValue=0),
+        square, borderType=cv2.BORDER_CONSTANT, borderValue=0
+    )
+    
+    # 4. Opening with a 2x2 square; the anchors make it a true opening like SciPy's
+    small_square = _SE2.view(np.uint8)
+    cleaned_features = cv2.dilate(
+        cv2.erode(connected_edges, small_square, anchor=(0, 0),
+                  borderType=cv2.BORDER_CONSTANT, borderValue=0),
+        small_square, anchor=(1, 1), borderType=cv2.BORDER_CONSTANT, borderValue=0
+    )
+    
+    return cleaned_features.view(np.bool_)
+
+def detect_subsurface_features(sar_data: np.ndarray, threshold: float = 0.7,
+                               percentile: Optional[float] = None) -> Optional[np.ndarray]:
+    """Detect potential subsurface features in the SAR data.
+    
+    Accepts normalized float data or uint8 data from `preprocess_sar_data`; the
+    threshold is a fraction of the strongest edge in either case. Pass a
+    `percentile` (0-100) instead to keep the edges above that percentile of
+    edge strength, which one bright outlier cannot skew. Uses OpenCV's SIMD
+    filters when it is installed.
+    
+    Raises ValueError if `percentile` is outside 0-100.
+    """
+    # Checked before the try block, so a bad argument is not logged as a detection failure
+    if percentile is not None and not 0 <= percentile <= 100:
+        raise ValueError(f"percentile must be between 0 and 100, got {percentile}")
+    
+    try:
+        import cv2
+    except ImportError:
+        cv2 = None
+    
     try:
-        # 1. Apply edge detection
-        edges = ndimage.sobel(sar_data)
+        if cv2 is not None and sar_data.ndim == 2:
+            return _detect_features_cv2(cv2, sar_data, threshold, percentile)
+        
+        from scipy import ndimage
+        
+        # 1. Apply edge detection along both axes in float32 (integer input
+        # would overflow in its own dtype); the kernel also finds the strongest edge
+        kernels = numba_kernels()
+        if kernels is not None and sar_data.ndim == 2:
+            edges = np.empty(sar_data.shape, dtype=np.float32)
+            max_edge = kernels.sobel_magnitude(np.ascontiguousarray(sar_data), edges)
+            edge_threshold = max_edge * threshold
+            if percentile is not None:
+                edge_threshold = _percentile_threshold(edges, percentile)
+        else:
+            # Sobel is separable, so each axis is two 1-D passes; comparing squared
+            # magnitudes against a squared threshold skips the square root
+            edges = ndimage.sobel(sar_data, axis=0, output=np.float32)
+            np.multiply(edges, edges, out=edges)
+            gradient = ndimage.sobel(sar_data, axis=1, output=np.float32)
+            np.multiply(gradient, gradient, out=gradient)
+            np.add(edges, gradient, out=edges)
+            del gradient
+            # Percentiles of squared magnitudes are the squared percentiles
+            if percentile is not None:
+                edge_threshold = _percentile_threshold(edges, percentile)
+            else:
+                edge_threshold = np.max(edges) * threshold * threshold
         
         # 2. Apply thresholding to identify strong edges
-        edge_threshold = np.max(edges) * threshold
-        strong_edges = edges > edge_threshold
+        strong_edges = _threshold_mask(edges, edge_threshold)
         
-        # 3. Apply morphological operations to connect edges
-        connected_edges = ndimage.binary_closing(strong_edges, structure=np.ones((3, 3)))
+        # 3. Apply morphological operations to connect edges; with square
+        # elements the max/min filters run as separable 1-D passes, and
+        # constant-zero borders match binary_closing's border_value=0
+        mask = np.ascontiguousarray(strong_edges).view(np.uint8)
+        connected_edges = ndimage.minimum_filter(
+            ndimage.maximum_filter(mask, size=_SE3.shape, mode='constant', cval=0),
+            size=_SE3.shape, mode='constant', cval=0
+        )
         
-        # 4. Remove small objects (noise)
-        cleaned_features = ndimage.binary_opening(connected_edges, structure=np.ones((2, 2)))
+        # 4. Remove small objects (noise); the dilation window is the mirror
+        # of the erosion window (origin -1), so this is a true 2x2 opening
+        cleaned_features = ndimage.maximum_filter(
+            ndimage.minimum_filter(connected_edges, size=_SE2.shape, mode='constant', cval=0),
+            size=_SE2.shape, mode='constant', cval=0, origin=-1
+        )
         
-        return cleaned_features
+        return cleaned_features.view(np.bool_)
     except Exception as e:
         logger.error(f"Error detecting subsurface features: {e}")
         return None
\ No newline at end of file
@@ -0,0 +1,51 @@
+"""
+Shared HTTP session for all Copernicus API calls.
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# CDSE allows at most 4 concurrent downloads per user
+MAX_PARALLEL_DOWNLOADS = 4
+
+# Timeouts in seconds; every request passes a (connect, read) pair so a
+# stalled connection can never hang a run
+CONNECT_TIMEOUT = 10
+READ_TIMEOUT = 60
+HTTP_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+
+# Product downloads are multi-GB, so allow much longer gaps between reads
+DOWNLOAD_TIMEOUT = (CONNECT_TIMEOUT, 300)
+
+# Connections kept per host by the shared session
+POOL_MAXSIZE = 20
+
+def create_session(pool_connections: int = 10, pool_maxsize: int = POOL_MAXSIZE,
+                   workers: int = MAX_PARALLEL_DOWNLOADS) -> requests.Session:
+    """Create a pooled HTTP session with retries on transient failures.
+    
+    The pool holds at least one connection per worker, so concurrent
+    downloads never discard and reopen connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=pool_connections,
+        pool_maxsize=max(pool_maxsize, workers),
+        max_retries=Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=frozenset(['GET', 'POST'])
+        )
+    )
+    session.mount('https://', adapter)
+    session.headers.update({'Accept': 'application/json'})
+    return session
+
+# Module-level session so keep-alive connections are reused across calls
+_SESSION = create_session()
+
+def get_session(analyzer) -> requests.Session:
+    """Return the analyzer's own session, or the shared pooled one."""
+    return analyzer._session or _SESSION
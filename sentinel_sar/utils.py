@@ -3,14 +3,49 @@ Utility functions for the Sentinel SAR Analysis package.
 """
 
 import os
+import json
 import logging
 import zipfile
 import datetime
-from typing import Optional, List
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import Optional, Iterator, List, Tuple
 import numpy as np
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 logger = logging.getLogger(__name__)
 
+# Decode JSON response bodies with orjson or ujson when either is installed
+if orjson is not None:
+    json_loads = orjson.loads
+elif ujson is not None:
+    json_loads = ujson.loads
+else:
+    json_loads = json.loads
+
+# Stream-parse large JSON arrays when orjson is missing and ijson has its C
+# backend; the pure-Python ijson backends are slower than json.loads
+STREAM_JSON = orjson is None and ijson is not None and ijson.backend == 'yajl2_c'
+
+def load_json_items(stream, prefix: str) -> List:
+    """Stream-parse the items under `prefix` (e.g. 'features.item') with ijson."""
+    return list(ijson.items(stream, prefix, use_float=True))
+
 def setup_logging(level=logging.INFO):
     """Set up logging configuration."""
     logging.basicConfig(
@@ -19,8 +54,27 @@ def setup_logging(level=logging.INFO):
     )
     return logging.getLogger(__name__)
 
+# Archives with less uncompressed data than this are extracted in-process
+PARALLEL_EXTRACT_MIN_BYTES = 256 * 1024 * 1024
+
+def _is_safe_member(name: str, extract_dir: str) -> bool:
+    """Check that an archive member stays inside the extraction directory (zip slip)."""
+    root = os.path.realpath(extract_dir)
+    target = os.path.realpath(os.path.join(root, name))
+    return os.path.commonpath([root, target]) == root
+
+def _extract_members(file_path: str, names: List[str], extract_dir: str) -> None:
+    """Process-pool worker extracting some members of an archive."""
+    with zipfile.ZipFile(file_path, 'r') as zip_ref:
+        for name in names:
+            zip_ref.extract(name, extract_dir)
+
 def extract_zip_file(file_path: str, extract_dir: Optional[str] = None) -> str:
-    """Extract a ZIP file and return the extraction directory."""
+    """Extract a ZIP file and return the extraction directory.
+    
+    Large archives are decompressed on several processes, each one
+    extracting a share of the members of about equal size.
+    """
     if extract_dir is None:
         extract_dir = os.path.join(os.path.dirname(file_path), 'extracted')
     
@@ -28,38 +82,141 @@ def extract_zip_file(file_path: str, extract_dir: Optional[str] = None) -> str:
     
     try:
         with zipfile.ZipFile(file_path, 'r') as zip_ref:
-            zip_ref.extractall(extract_dir)
+            members = []
+            for info in zip_ref.infolist():
+                if _is_safe_member(info.filename, extract_dir):
+                    members.append(info)
+                else:
+                    logger.warning(f"Skipping archive member outside the target directory: {info.filename}")
+            
+            workers = min(os.cpu_count() or 1, len(members))
+            total_size = sum(info.file_size for info in members)
+            if workers < 2 or total_size < PARALLEL_EXTRACT_MIN_BYTES:
+                zip_ref.extractall(extract_dir, members=members)
+                logger.info(f"Successfully extracted {file_path} to {extract_dir}")
+                return extract_dir
+        
+        # Directories first, so workers never race to create them
+        for info in members:
+            if info.is_dir():
+                os.makedirs(os.path.join(extract_dir, info.filename), exist_ok=True)
+        
+        # Balance the members across workers by size, largest first
+        shares = [[] for _ in range(workers)]
+        share_sizes = [0] * workers
+        for info in sorted(members, key=lambda member: member.file_size, reverse=True):
+            if info.is_dir():
+                continue
+            smallest = share_sizes.index(min(share_sizes))
+            shares[smallest].append(info.filename)
+            share_sizes[smallest] += info.file_size
+        
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            futures = [executor.submit(_extract_members, file_path, names, extract_dir)
+                       for names in shares if names]
+            for future in futures:
+                future.result()
+        
         logger.info(f"Successfully extracted {file_path} to {extract_dir}")
         return extract_dir
     except Exception as e:
         logger.error(f"Error extracting ZIP file: {e}")
         return ""
 
+def iter_files_by_extension(directory: str, extension: str) -> Iterator[str]:
+    """Yield the files with a specific extension in a directory (recursive).
+    
+    Files of a directory come before those of its subdirectories, as with os.walk.
+    """
+    suffix = extension.lower()
+    subdirectories = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.name.lower().endswith(suffix):
+                    yield entry.path
+    except OSError as e:
+        logger.warning(f"Could not list {directory}: {e}")
+        return
+    
+    for subdirectory in subdirectories:
+        yield from iter_files_by_extension(subdirectory, suffix)
+
 def find_files_by_extension(directory: str, extension: str) -> List[str]:
     """Find all files with a specific extension in a directory (recursive)."""
-    found_files = []
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.lower().endswith(extension.lower()):
-                found_files.append(os.path.join(root, file))
-    return found_files
+    return list(iter_files_by_extension(directory, extension))
+
+@lru_cache(maxsize=1024)
+def _convert_date(date_str: str, input_format: str, output_format: str) -> str:
+    """Cached strptime/strftime round trip; failures raise and are not cached."""
+    return datetime.datetime.strptime(date_str, input_format).strftime(output_format)
 
 def convert_date_format(date_str: str, input_format: str, output_format: str) -> str:
     """Convert a date string from one format to another."""
     try:
-        date_obj = datetime.datetime.strptime(date_str, input_format)
-        return date_obj.strftime(output_format)
+        return _convert_date(date_str, input_format, output_format)
     except ValueError as e:
         logger.error(f"Error converting date format: {e}")
         return date_str
 
+@lru_cache(maxsize=1)
+def numba_kernels():
+    """Return the `kernels` module, importing Numba on first use; None without Numba."""
+    try:
+        from sentinel_sar import kernels
+    except ImportError:
+        return None
+    return kernels
+
+@lru_cache(maxsize=1)
+def numexpr_module():
+    """Return numexpr, importing it on first use; None when it is not installed."""
+    try:
+        import numexpr
+    except ImportError:
+        return None
+    return numexpr
+
 def normalize_array(array: np.ndarray) -> np.ndarray:
-    """Normalize an array to the range [0, 1]."""
-    min_val = np.min(array)
-    max_val = np.max(array)
+    """Normalize an array to the range [0, 1].
+    
+    The minimum and maximum come from one Numba pass over 2-D input, and
+    the scaling is a single pass into one output buffer, on several
+    threads when numexpr is installed.
+    """
+    kernels = numba_kernels()
+    if kernels is not None and array.ndim == 2:
+        min_val, max_val = kernels.min_max(array)
+    else:
+        min_val = np.min(array)
+        max_val = np.max(array)
     if max_val == min_val:
         return np.zeros_like(array)
-    return (array - min_val) / (max_val - min_val)
+    
+    dtype = array.dtype if np.issubdtype(array.dtype, np.floating) else np.dtype(np.float64)
+    offset = dtype.type(min_val)
+    scale = dtype.type(1.0 / (float(max_val) - float(min_val)))
+    numexpr = numexpr_module()
+    if numexpr is not None and dtype in (np.float32, np.float64):
+        return numexpr.evaluate('(array - offset) * scale',
+                                local_dict={'array': array, 'offset': offset, 'scale': scale})
+    
+    normalized = np.subtract(array, offset, dtype=dtype)
+    np.multiply(normalized, scale, out=normalized)
+    return normalized
+
+def downsample_array(array: np.ndarray, max_size: int) -> np.ndarray:
+    """Block-average a 2-D array so its longest side is about `max_size` pixels."""
+    factor = max(1, max(array.shape) // max_size)
+    if factor == 1:
+        return array
+    height = array.shape[0] // factor * factor
+    width = array.shape[1] // factor * factor
+    blocks = array[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    return blocks.mean(axis=(1, 3), dtype=np.float32)
 
 def create_directory_if_not_exists(directory: str) -> bool:
     """Create a directory if it doesn't exist."""
@@ -70,37 +227,49 @@ def create_directory_if_not_exists(directory: str) -> bool:
         logger.error(f"Error creating directory {directory}: {e}")
         return False
 
+_SIZE_UNITS = ('B', 'KB', 'MB', 'GB', 'TB', 'PB')
+
+def format_file_size(size_bytes: int) -> str:
+    """Format a byte count in a human-readable way."""
+    # Each unit is 2**10 times the previous one, so the bit length picks it directly
+    index = min(max(int(size_bytes).bit_length() - 1, 0) // 10, len(_SIZE_UNITS) - 1)
+    return f"{size_bytes / (1 << (10 * index)):.2f} {_SIZE_UNITS[index]}"
+
+def get_file_size_from_stat(st: os.stat_result) -> str:
+    """Human-readable size from an existing `os.stat`/`DirEntry.stat()` result."""
+    return format_file_size(st.st_size)
+
 def get_file_size(file_path: str) -> str:
     """Get the size of a file in a human-readable format."""
     try:
-        size_bytes = os.path.getsize(file_path)
-        for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
-            if size_bytes < 1024.0:
-                return f"{size_bytes:.2f} {unit}"
-            size_bytes /= 1024.0
-        return f"{size_bytes:.2f} PB"
+        return format_file_size(os.path.getsize(file_path))
     except Exception as e:
         logger.error(f"Error getting file size: {e}")
         return "Unknown"
 
-def validate_coordinates(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> bool:
-    """Validate geographic coordinates."""
+@lru_cache(maxsize=1024)
+def _coordinates_error(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> Optional[str]:
+    """Return why the coordinates are invalid, or None if they are valid."""
     if not (-180 <= min_lon <= 180 and -180 <= max_lon <= 180):
-        logger.error("Longitude values must be between -180 and 180 degrees")
-        return False
+        return "Longitude values must be between -180 and 180 degrees"
     
     if not (-90 <= min_lat <= 90 and -90 <= max_lat <= 90):
-        logger.error("Latitude values must be between -90 and 90 degrees")
-        return False
+        return "Latitude values must be between -90 and 90 degrees"
     
     if min_lon >= max_lon:
-        logger.error("Minimum longitude must be less than maximum longitude")
-        return False
+        return "Minimum longitude must be less than maximum longitude"
     
     if min_lat >= max_lat:
-        logger.error("Minimum latitude must be less than maximum latitude")
-        return False
+        return "Minimum latitude must be less than maximum latitude"
     
+    return None
+
+def validate_coordinates(min_lon: float, min_lat: float, max_lon: float, max_lat: float) -> bool:
+    """Validate geographic coordinates."""
+    error = _coordinates_error(min_lon, min_lat, max_lon, max_lat)
+    if error is not None:
+        logger.error(error)
+        return False
     return True
 
 def validate_date_range(start_date: str, end_date: str, date_format: str = '%Y%m%d') -> bool:
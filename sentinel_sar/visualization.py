@@ -3,30 +3,87 @@ Visualization functions for SAR data.
 """
 
 import logging
+from typing import Optional, Tuple
 import numpy as np
-import matplotlib.pyplot as plt
+
+from sentinel_sar.processing import DISPLAY_MAX_SIZE
+from sentinel_sar.utils import normalize_array, downsample_array
 
 logger = logging.getLogger(__name__)
 
+def _colorize(data: np.ndarray, cmap: str) -> np.ndarray:
+    """Map an array to uint8 RGB with a matplotlib colormap, scaled like `imshow`."""
+    import matplotlib
+    
+    normalized = normalize_array(np.asarray(data, dtype=np.float32))
+    return matplotlib.colormaps[cmap](normalized, bytes=True)[..., :3]
+
+def _for_display(data: np.ndarray) -> np.ndarray:
+    """Block-average an array to display resolution; masks keep any set pixel."""
+    reduced = downsample_array(data, DISPLAY_MAX_SIZE)
+    if data.dtype == np.bool_ and reduced is not data:
+        return reduced > 0
+    return reduced
+
+def _save_panels(output_path, panels: list, cols: int) -> None:
+    """Write RGB panels as one PNG grid, without rendering a figure."""
+    from PIL import Image
+    
+    height = max(panel.shape[0] for panel in panels)
+    width = max(panel.shape[1] for panel in panels)
+    rows = (len(panels) + cols - 1) // cols
+    
+    grid = np.zeros((rows * height, cols * width, 3), dtype=np.uint8)
+    for i, panel in enumerate(panels):
+        row, col = divmod(i, cols)
+        grid[row * height:row * height + panel.shape[0],
+             col * width:col * width + panel.shape[1]] = panel
+    # Fast zlib level: the files get slightly larger, but encoding is several times quicker
+    Image.fromarray(grid).save(output_path, compress_level=1)
+
 def visualize_results(analyzer, original_data: np.ndarray, processed_data: np.ndarray, 
-                      features: np.ndarray, title: str = "SAR Analysis Results") -> None:
-    """Visualize the original data, processed data, and detected features."""
+                      features: np.ndarray, title: str = "SAR Analysis Results",
+                      headless: bool = False, filename: str = 'sar_analysis_results.png') -> None:
+    """Visualize the original data, processed data, and detected features.
+    
+    With `headless` the panels are written straight to the PNG, without
+    titles or a window, which is much faster for batch runs. The image is
+    saved as `filename` in the download directory.
+    """
     try:
+        # Nothing finer than the figure resolution is visible, so plot reduced copies
+        original_data, processed_data, features = (
+            _for_display(data) for data in (original_data, processed_data, features))
+        
+        output_path = analyzer.download_path / filename
+        if headless:
+            background = _colorize(processed_data, 'gray').astype(np.uint16)
+            overlay = ((background + _colorize(features, 'hot')) // 2).astype(np.uint8)
+            _save_panels(output_path, [
+                _colorize(original_data, 'gray'),
+                _colorize(processed_data, 'viridis'),
+                overlay
+            ], cols=3)
+            logger.info(f"Results saved to {output_path}")
+            return
+        
+        import matplotlib.pyplot as plt
+        
         fig, axes = plt.subplots(1, 3, figsize=(18, 6))
         
         # Plot original data
-        axes[0].imshow(original_data, cmap='gray')
+        axes[0].imshow(original_data, cmap='gray', interpolation='nearest')
         axes[0].set_title('Original SAR Data')
         axes[0].axis('off')
         
         # Plot processed data
-        axes[1].imshow(processed_data, cmap='viridis')
+        axes[1].imshow(processed_data, cmap='viridis', interpolation='nearest')
         axes[1].set_title('Processed SAR Data')
         axes[1].axis('off')
         
         # Plot detected features
-        axes[2].imshow(processed_data, cmap='gray')
-        axes[2].imshow(features, cmap='hot', alpha=0.5)
+        axes[2].imshow(processed_data, cmap='gray', interpolation='nearest')
+        axes[2].imshow(features, cmap='hot', alpha=0.5, interpolation='nearest')
         axes[2].set_title('Detected Subsurface Features')
         axes[2].axis('off')
         
@@ -34,17 +91,19 @@ def visualize_results(analyzer, original_data: np.ndarray, processed_data: np.nd
         plt.tight_layout()
         
         # Save the figure
-        output_path = analyzer.download_path / 'sar_analysis_results.png'
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
+        plt.savefig(output_path, dpi=300)
         logger.info(f"Results saved to {output_path}")
         
-        # Show the figure
-        plt.show()
+        # Show the figure unless running headless on Agg
+        if plt.get_backend().lower() != 'agg':
+            plt.show()
+        plt.close(fig)
         
     except Exception as e:
         logger.error(f"Error visualizing results: {e}")
 
-def visualize_time_series(analyzer, time_series_data: list, dates: list, title: str = "SAR Time Series Analysis") -> None:
+def visualize_time_series(analyzer, time_series_data: list, dates: list, title: str = "SAR Time Series Analysis",
+                          headless: bool = False, filename: str = 'sar_time_series_results.png') -> None:
     """Visualize a time series of SAR data to detect changes over time."""
     try:
         n_images = len(time_series_data)
@@ -56,6 +115,16 @@ def visualize_time_series(analyzer, time_series_data: list, dates: list, title:
         cols = min(4, n_images)
         rows = (n_images + cols - 1) // cols
         
+        time_series_data = [_for_display(data) for data in time_series_data]
+        
+        output_path = analyzer.download_path / filename
+        if headless:
+            _save_panels(output_path, [_colorize(data, 'viridis') for data in time_series_data], cols)
+            logger.info(f"Time series results saved to {output_path}")
+            return
+        
+        import matplotlib.pyplot as plt
+        
         fig, axes = plt.subplots(rows, cols, figsize=(cols * 5, rows * 5))
         if rows == 1 and cols == 1:
             axes = np.array([axes])
@@ -64,7 +133,7 @@ def visualize_time_series(analyzer, time_series_data: list, dates: list, title:
         # Plot each image in the time series
         for i, (data, date) in enumerate(zip(time_series_data, dates)):
             if i < len(axes):
-                axes[i].imshow(data, cmap='viridis')
+                axes[i].imshow(data, cmap='viridis', interpolation='nearest')
                 axes[i].set_title(f'Date: {date}')
                 axes[i].axis('off')
         
@@ -76,36 +145,53 @@ def visualize_time_series(analyzer, time_series_data: list, dates: list, title:
         plt.tight_layout()
         
         # Save the figure
-        output_path = analyzer.download_path / 'sar_time_series_results.png'
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
+        plt.savefig(output_path, dpi=300)
         logger.info(f"Time series results saved to {output_path}")
         
-        # Show the figure
-        plt.show()
+        # Show the figure unless running headless on Agg
+        if plt.get_backend().lower() != 'agg':
+            plt.show()
+        plt.close(fig)
         
     except Exception as e:
         logger.error(f"Error visualizing time series: {e}")
 
 def visualize_change_detection(analyzer, before_data: np.ndarray, after_data: np.ndarray, 
-                              difference: np.ndarray, title: str = "SAR Change Detection") -> None:
+                              difference: np.ndarray, title: str = "SAR Change Detection",
+                              headless: bool = False, filename: str = 'sar_change_detection_results.png') -> None:
     """Visualize before and after SAR data with highlighted changes."""
     try:
+        before_data, after_data, difference = (
+            _for_display(data) for data in (before_data, after_data, difference))
+        
+        output_path = analyzer.download_path / filename
+        if headless:
+            _save_panels(output_path, [
+                _colorize(before_data, 'gray'),
+                _colorize(after_data, 'gray'),
+                _colorize(difference, 'RdBu_r')
+            ], cols=3)
+            logger.info(f"Change detection results saved to {output_path}")
+            return
+        
+        import matplotlib.pyplot as plt
+        
         fig, axes = plt.subplots(1, 3, figsize=(18, 6))
         
         # Plot before data
-        axes[0].imshow(before_data, cmap='gray')
+        axes[0].imshow(before_data, cmap='gray', interpolation='nearest')
         axes[0].set_title('Before')
         axes[0].axis('off')
         
         # Plot after data
-        axes[1].imshow(after_data, cmap='gray')
+        axes[1].imshow(after_data, cmap='gray', interpolation='nearest')
         axes[1].set_title('After')
         axes[1].axis('off')
         
         # Plot difference with threshold
         # Normalize difference for better visualization
         norm_diff = (difference - np.min(difference)) / (np.max(difference) - np.min(difference))
-        axes[2].imshow(norm_diff, cmap='RdBu_r')
+        axes[2].imshow(norm_diff, cmap='RdBu_r', interpolation='nearest')
         axes[2].set_title('Change Detection')
         axes[2].axis('off')
         
@@ -113,37 +199,42 @@ def visualize_change_detection(analyzer, before_data: np.ndarray, after_data: np
         plt.tight_layout()
         
         # Save the figure
-        output_path = analyzer.download_path / 'sar_change_detection_results.png'
-        plt.savefig(output_path, dpi=300, bbox_inches='tight')
+        plt.savefig(output_path, dpi=300)
         logger.info(f"Change detection results saved to {output_path}")
         
-        # Show the figure
-        plt.show()
+        # Show the figure unless running headless on Agg
+        if plt.get_backend().lower() != 'agg':
+            plt.show()
+        plt.close(fig)
         
     except Exception as e:
         logger.error(f"Error visualizing change detection: {e}")
 
 def create_interactive_map(analyzer, sar_data: np.ndarray, geotransform, crs, 
-                          title: str = "Interactive SAR Data Map") -> None:
-    """Create an interactive map of the SAR data with geographic coordinates."""
+                          title: str = "Interactive SAR Data Map",
+                          bounds: Optional[Tuple[float, float, float, float]] = None) -> None:
+    """Create an interactive map of the SAR data with geographic coordinates.
+    
+    Pass `bounds` as (west, south, east, north) when they are already known,
+    e.g. from an open dataset's `src.bounds`, to skip deriving them again.
+    """
     try:
         # This function requires additional libraries like folium
         # Check if folium is installed
         try:
             import folium
-            from folium import plugins
-            import rasterio
-            from rasterio.transform import from_origin
-            from sentinel_sar.utils import normalize_array
         except ImportError:
-            logger.error("This function requires folium and rasterio. Install with: pip install folium rasterio")
+            logger.error("This function requires folium. Install with: pip install folium")
             return
             
         # Get the bounds of the data
-        height, width = sar_data.shape
-        west, north = geotransform[0], geotransform[3]
-        east = west + width * geotransform[1]
-        south = north + height * geotransform[5]  # Note: geotransform[5] is typically negative
+        if bounds is not None:
+            west, south, east, north = bounds
+        else:
+            height, width = sar_data.shape
+            west, north = geotransform[0], geotransform[3]
+            east = west + width * geotransform[1]
+            south = north + height * geotransform[5]  # Note: geotransform[5] is typically negative
         
         # Create a centered map
         center_lat = (north + south) / 2
@@ -151,7 +242,7 @@ def create_interactive_map(analyzer, sar_data: np.ndarray, geotransform, crs,
         map_obj = folium.Map(location=[center_lat, center_lon], zoom_start=10)
         
         # Add the SAR data as an overlay - use utility function for normalization
-        img_data = normalize_array(sar_data.copy()) * 255
+        img_data = normalize_array(sar_data) * 255
         img_data = img_data.astype(np.uint8)
         
         # Add the image overlay
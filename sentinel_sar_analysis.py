@@ -8,41 +8,31 @@ Author: Alberto Barrago
 
 import datetime
 import logging
-
-from dotenv import load_dotenv
-from sentinel_sar.analyzer import SARAnalyzer
 import os
 
-load_dotenv()
-
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+# Default coordinates (Giza, Egypt)
+_DEFAULT_COORDS = {
+    'min_lon': 31.0,
+    'min_lat': 29.9,
+    'max_lon': 31.2,
+    'max_lat': 30.1
+}
+
 def main():
     """Main function to run the SAR analysis tool."""
     logger.info("\n=== SAR Data Analysis Tool ===")
     logger.info("This tool fetches and analyzes SAR data to detect potential subsurface features.")
     
-    analyzer = SARAnalyzer(
-        client_id=os.getenv('CLIENT_ID'),
-        client_secret=os.getenv('CLIENT_SECRET')
-    )
-    
-    # Default coordinates (Giza, Egypt)
-    giza_coords = {
-        'min_lon': 31.0,
-        'min_lat': 29.9,
-        'max_lon': 31.2,
-        'max_lat': 30.1
-    }
-    
     try:
         # Get coordinates with validation
         coords = {}
-        for key, default in giza_coords.items():
+        for key, default in _DEFAULT_COORDS.items():
             while True:
                 try:
                     value = input(f"{key} [{default}]: ").strip() or default
@@ -64,6 +54,15 @@ def main():
         # Ask for sensor mode
         sensor_mode = input("Sensor mode (IW/EW/SM/WV) [IW]: ").upper() or "IW"
         
+        # Import the package (numpy, requests, optional Numba) only once the
+        # prompts are answered, so they appear without delay
+        from sentinel_sar.analyzer import SARAnalyzer
+        
+        analyzer = SARAnalyzer(
+            client_id=os.getenv('CLIENT_ID'),
+            client_secret=os.getenv('CLIENT_SECRET')
+        )
+        
         logger.info("\nStarting analysis...")
         # In the main function, make sure the analyze_area call matches the method definition
         if analyzer.analyze_area(
@@ -77,7 +76,7 @@ def main():
             sensor_mode=sensor_mode
         ):
             logger.info("\nAnalysis completed successfully!")
-            logger.info(f"Results saved to {analyzer.download_path / 'sar_analysis_results.png'}")
+            logger.info(f"Results saved to {analyzer.download_path}/sar_analysis_results_*.png")
         else:
             logger.error("\nAnalysis failed. Please check the error messages above.")
             
@@ -4,14 +4,13 @@ setup(
     name="sentinel_sar",
     version="0.1.0",
     packages=find_packages(),
+    python_requires='>=3.8',
     install_requires=[
-        'sentinelsat',
         'rasterio',
         'numpy',
-        'matplotlib',
+        'matplotlib>=3.5',
+        'Pillow',
         'scipy',
-        'geopandas',
-        'shapely',
         'python-dotenv'
     ]
 )
\ No newline at end of file